@@ -0,0 +1,74 @@
+import os
+import html
+
+# Telegram allows 2-10 photos per media group and 4096 characters per message
+MEDIA_GROUP_SIZE = 10
+MESSAGE_MAX_CHARS = 4096
+# More changes than this in one check are sent as a text digest instead of cards
+DIGEST_THRESHOLD = int(os.getenv('DIGEST_THRESHOLD', 30))
+# Digest pages sent at most; the rest is summarized in the last page
+DIGEST_MAX_PAGES = int(os.getenv('DIGEST_MAX_PAGES', 3))
+
+
+def plan_notifications(added_songs, removed_songs, digest_threshold=DIGEST_THRESHOLD):
+    """Pack the changes of one check into as few Telegram sends as possible
+
+    Returns a list of batches:
+    - ('card', [(song, action)]) for a song sent as a single photo or text card
+    - ('album', [(song, action), ...]) for 2-10 songs sent as one media group
+    - ('digest', [(song, action), ...]) for a large change set sent as text
+    """
+    changes = [(song, 'added') for song in added_songs] + [(song, 'removed') for song in removed_songs]
+    if not changes:
+        return []
+    if len(changes) > digest_threshold:
+        return [('digest', changes)]
+
+    batches = []
+    for action in ('added', 'removed'):
+        with_art = [(song, action) for song, song_action in changes if song_action == action and song.thumbnail]
+        without_art = [(song, action) for song, song_action in changes if song_action == action and not song.thumbnail]
+        for start in range(0, len(with_art), MEDIA_GROUP_SIZE):
+            chunk = with_art[start:start + MEDIA_GROUP_SIZE]
+            batches.append(('album' if len(chunk) > 1 else 'card', chunk))
+        batches.extend(('card', [change]) for change in without_art)
+    return batches
+
+
+def playlist_line(playlist_id):
+    """The line naming the playlist a notification is about, empty without one"""
+    return f"🎧 Playlist: <code>{html.escape(playlist_id)}</code>\n" if playlist_id else ""
+
+
+def format_digest_pages(changes, playlist_id=None, max_pages=DIGEST_MAX_PAGES, max_chars=MESSAGE_MAX_CHARS):
+    """Format a large change set of one playlist as one or more text messages"""
+    added_count = sum(1 for _, action in changes if action == 'added')
+    removed_count = len(changes) - added_count
+    header = (
+        f"📋 <b>Playlist Update</b>\n"
+        f"{playlist_line(playlist_id)}"
+        f"➕ {added_count} added · ➖ {removed_count} removed\n\n"
+    )
+
+    lines = []
+    for song, action in changes:
+        emoji = "➕" if action == 'added' else "➖"
+        title = html.escape(song.title or 'Unknown Title')
+        artists = html.escape(song.artists or 'Unknown Artist')
+        video_id = song.videoId or ''
+        lines.append(f"{emoji} <a href='https://music.youtube.com/watch?v={video_id}'>{title}</a> - {artists}")
+
+    # Leave room for the "...and N more" footer on the last page
+    budget = max_chars - 100
+    pages = []
+    current = header
+    for index, line in enumerate(lines):
+        if len(current) + len(line) + 1 > budget:
+            if len(pages) + 1 == max_pages:
+                current += f"\n…and {len(lines) - index} more changes"
+                break
+            pages.append(current)
+            current = ""
+        current += line + "\n"
+    pages.append(current.rstrip("\n"))
+    return pages
@@ -0,0 +1,259 @@
+"""End-to-end benchmark of the polling pipeline against fake YouTube Music and Telegram
+
+Run from the repository root:
+
+    python benchmarks/bench_cycle.py [--sections diff,state,fanout,cycle] [--sizes 100,1000,10000,50000]
+
+Sections:
+
+    diff    parse_track and diff_playlists on synthetic playlists after one round of churn
+    state   snapshot save, change log append and load in a fresh SQLite database
+    fanout  messages per second the dispatcher pushes to N subscribers
+    cycle   full polling rounds through bot.py: fetch, diff, save, queue and deliver
+
+Nothing touches the network: YouTube Music and the Bot are the stand-ins in
+benchmarks/fakes.py, and all state goes to a temporary directory. Album art
+file_ids are pre-seeded, as they are once a bot has been running for a while.
+"""
+import os
+import sys
+import time
+import atexit
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import SyntheticPlaylist, FakeYTMusic, FakeBot, album_thumbnails
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sections', default='diff,state,fanout,cycle')
+    parser.add_argument('--sizes', type=int_list, default=[100, 1000, 10000, 50000],
+                        help='playlist sizes for the diff and state sections')
+    parser.add_argument('--subscribers', type=int_list, default=[10, 100, 1000, 10000],
+                        help='subscriber counts for the fanout section')
+    parser.add_argument('--churn', type=float, default=0.01, help='share of songs added and removed per round')
+    parser.add_argument('--moves', type=int, default=5, help='songs moved per round')
+    parser.add_argument('--albums', type=int, default=500, help='distinct album thumbnails')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, best is reported')
+    parser.add_argument('--playlists', type=int, default=20, help='playlists polled in the cycle section')
+    parser.add_argument('--playlist-size', type=int, default=1000, help='songs per playlist in the cycle section')
+    parser.add_argument('--chats', type=int, default=50, help='chats following each playlist in the cycle section')
+    parser.add_argument('--rounds', type=int, default=3, help='rounds with churn in the cycle section')
+    parser.add_argument('--yt-latency', type=float, default=0.05, help='seconds per fake YouTube Music request')
+    parser.add_argument('--yt-jitter', type=float, default=0.02, help='extra random seconds per request')
+    parser.add_argument('--yt-error-rate', type=float, default=0.0, help='share of requests failing with HTTP 503')
+    parser.add_argument('--yt-get-playlist', action='store_true',
+                        help='serve whole playlists through the get_playlist fallback instead of browse pages')
+    parser.add_argument('--yt-truncate-pages', type=int, default=None,
+                        help='pages served before continuations come back empty (default: all of them)')
+    parser.add_argument('--bot-latency', type=float, default=0.002, help='seconds per fake Telegram call')
+    parser.add_argument('--bot-error-rate', type=float, default=0.0, help='share of sends failing with a network error')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='every Nth send gets RetryAfter (0 = never)')
+    parser.add_argument('--retry-after', type=int, default=1, help='seconds asked for by RetryAfter')
+    parser.add_argument('--telegram-rate', type=float, default=0,
+                        help='global messages per second (0 = unlimited, 30 = what Telegram allows)')
+    parser.add_argument('--chat-rate', type=float, default=0, help='messages per second per chat (0 = unlimited)')
+    parser.add_argument('--log-level', default='ERROR')
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+
+def configure(args):
+    """Point the bot's settings at a scratch directory before its modules are imported
+
+    The directory, with its database and thumbnail cache, is removed on exit.
+    """
+    workdir = tempfile.mkdtemp(prefix='ytm-bench-')
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    os.chdir(workdir)
+    os.environ.update({
+        'DATABASE_FILE': os.path.join(workdir, 'bot_state.db'),
+        'THUMBNAIL_CACHE_DIR': os.path.join(workdir, 'thumbnail_cache'),
+        'TELEGRAM_GLOBAL_RATE': str(args.telegram_rate or 1e9),
+        'TELEGRAM_CHAT_RATE': str(args.chat_rate or 1e9),
+        'UPSTREAM_RETRY_BASE': '0.01',
+        'UPSTREAM_RETRY_MAX': '0.1',
+        'LOG_LEVEL': args.log_level,
+        'YOUTUBE_PLAYLIST_ID': 'PLbench-default',
+    })
+    from tracing import setup_logging
+    setup_logging()
+    return workdir
+
+
+def best_of(repeat, func):
+    """Fastest of repeat runs of func() in seconds, and its last result"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def bench_diff(args):
+    from bot import parse_track
+    from diff import diff_playlists
+
+    print(f"\n== diff: {args.churn:.1%} churn, {args.moves} moves ==")
+    print(f"{'size':>7} {'parse ms':>10} {'diff ms':>10} {'added':>7} {'removed':>8} {'moved':>6}")
+    for size in args.sizes:
+        playlist = SyntheticPlaylist('PLdiff', size, args.churn, args.moves, args.albums, seed=args.seed)
+        raw = [dict(track) for track in playlist.tracks]
+        parse_time, old = best_of(args.repeat, lambda: [parse_track(track) for track in raw])
+        playlist.step()
+        new = [parse_track(track) for track in playlist.tracks]
+        diff_time, diff = best_of(args.repeat, lambda: diff_playlists(old, new))
+        print(f"{size:>7} {parse_time * 1000:>10.2f} {diff_time * 1000:>10.2f} "
+              f"{len(diff.added):>7} {len(diff.removed):>8} {len(diff.moved):>6}")
+
+
+def bench_state(args, workdir):
+    from bot import parse_track
+    from diff import diff_playlists, playlist_fingerprint
+    from store import StateStore
+
+    print("\n== state: SQLite snapshot I/O ==")
+    print(f"{'size':>7} {'save ms':>10} {'append ms':>10} {'load ms':>10} {'compact ms':>11} {'events':>7}")
+    for size in args.sizes:
+        store = StateStore(os.path.join(workdir, f'state-{size}.db'))
+        playlist = SyntheticPlaylist('PLstate', size, args.churn, args.moves, args.albums, seed=args.seed)
+        old = [parse_track(track) for track in playlist.tracks]
+        playlist.step()
+        new = [parse_track(track) for track in playlist.tracks]
+        diff = diff_playlists(old, new)
+        fingerprint = playlist_fingerprint(new)
+
+        save_time, _ = best_of(args.repeat, lambda: store.save_snapshot('PLstate', old))
+
+        def append():
+            store.save_snapshot('PLstate', old)
+            started = time.perf_counter()
+            store.record_changes('PLstate', diff.events, fingerprint)
+            return time.perf_counter() - started
+        append_time = min(append() for _ in range(args.repeat))
+
+        # The last append is still pending, as after a normal check, unless it
+        # reached SNAPSHOT_COMPACT_EVENTS and was compacted on the spot
+        load_time, loaded = best_of(args.repeat, lambda: store.load_snapshot('PLstate'))
+        assert [track.videoId for track in loaded] == [track.videoId for track in new]
+        compact_time, _ = best_of(1, lambda: store.compact_snapshot('PLstate'))
+        store.close()
+        print(f"{size:>7} {save_time * 1000:>10.2f} {append_time * 1000:>10.2f} {load_time * 1000:>10.2f} "
+              f"{compact_time * 1000:>11.2f} {len(diff.events):>7}")
+
+
+def bench_fanout(args):
+    from dispatcher import FanoutDispatcher
+
+    print(f"\n== fanout: bot latency {args.bot_latency * 1000:.0f} ms, "
+          f"rate limit every {args.rate_limit_every or '-'} sends ==")
+    print(f"{'chats':>7} {'seconds':>9} {'msg/s':>10} {'delivered':>10} {'retry after':>12} {'errors':>7}")
+
+    async def run(count):
+        bot = FakeBot(args.bot_latency, args.bot_error_rate, args.rate_limit_every, args.retry_after, args.seed)
+        dispatcher = FanoutDispatcher(
+            global_rate=args.telegram_rate or 1e9, chat_rate=args.chat_rate or 1e9, max_retries=3
+        )
+
+        async def send(chat_id):
+            await bot.send_message(chat_id=chat_id, text='benchmark', parse_mode='HTML')
+
+        started = time.perf_counter()
+        delivered = await dispatcher.fan_out(range(count), send)
+        return time.perf_counter() - started, delivered, bot
+
+    for count in args.subscribers:
+        elapsed, delivered, bot = asyncio.run(run(count))
+        print(f"{count:>7} {elapsed:>9.3f} {delivered / elapsed:>10.0f} {delivered:>10} "
+              f"{bot.rate_limited:>12} {bot.errors:>7}")
+
+
+def bench_cycle(args):
+    import bot
+
+    playlists = [
+        SyntheticPlaylist(f'PLbench{number:04d}', args.playlist_size, args.churn, args.moves, args.albums,
+                          seed=args.seed)
+        for number in range(args.playlists)
+    ]
+    fake_ytmusic = FakeYTMusic(playlists, args.yt_latency, args.yt_jitter, args.yt_error_rate, args.seed,
+                               browse=not args.yt_get_playlist, truncate_after=args.yt_truncate_pages)
+    bot.ytmusic = fake_ytmusic
+    fake_bot = FakeBot(args.bot_latency, args.bot_error_rate, args.rate_limit_every, args.retry_after, args.seed)
+    for number, url in enumerate(album_thumbnails(args.albums)):
+        bot.state_store.set_thumbnail_file_id(url, f'seeded-{number}')
+
+    groups = {
+        playlist.playlist_id: [number * args.chats + chat for chat in range(args.chats)]
+        for number, playlist in enumerate(playlists)
+    }
+
+    print(f"\n== cycle: {args.playlists} playlists x {args.playlist_size} songs, {args.chats} chats each, "
+          f"YouTube Music {args.yt_latency * 1000:.0f} ms, {args.yt_error_rate:.0%} errors ==")
+    print(f"{'round':>5} {'kind':<10} {'check s':>8} {'deliver s':>10} {'total s':>8} "
+          f"{'changed':>8} {'failed':>7} {'messages':>9} {'yt reqs':>9}")
+
+    async def poll(playlist_id, chat_ids):
+        diff = await bot.check_playlist_group(fake_bot, playlist_id, chat_ids, force_refresh=True)
+        if diff is None:
+            raise RuntimeError('fetch failed')
+        if diff.changed:
+            changed.append(playlist_id)
+
+    async def run_round(number, kind):
+        changed.clear()
+        calls, messages = fake_ytmusic.calls, fake_bot.messages
+        started = time.perf_counter()
+        # window=0 starts every check at once instead of spreading them out
+        cycle = await bot.poll_scheduler.run_cycle(groups.items(), poll, window=0)
+        checked = time.perf_counter()
+        await bot.deliver_outbox(fake_bot)
+        finished = time.perf_counter()
+        print(f"{number:>5} {kind:<10} {checked - started:>8.3f} {finished - checked:>10.3f} "
+              f"{finished - started:>8.3f} {len(changed):>8} {cycle['failures']:>7} "
+              f"{fake_bot.messages - messages:>9} {fake_ytmusic.calls - calls:>9}")
+
+    async def main():
+        await run_round(0, 'baseline')
+        for number in range(1, args.rounds + 1):
+            for playlist in playlists:
+                playlist.step()
+            await run_round(number, 'churn')
+        await run_round(args.rounds + 1, 'unchanged')
+        await bot.image_fetcher.close()
+
+    changed = []
+    asyncio.run(main())
+    print(f"outbox left: {bot.state_store.outbox_depth()}, dispatcher: {bot.dispatcher.stats['sent']} sent, "
+          f"{bot.dispatcher.stats['failed']} failed, {bot.dispatcher.stats['rate_limited']} rate limited")
+
+
+def main():
+    args = parse_args()
+    workdir = configure(args)
+    sections = set(args.sections.split(','))
+    print(f"Scratch directory: {workdir}")
+    if 'diff' in sections:
+        bench_diff(args)
+    if 'state' in sections:
+        bench_state(args, workdir)
+    if 'fanout' in sections:
+        bench_fanout(args)
+    if 'cycle' in sections:
+        bench_cycle(args)
+
+
+if __name__ == '__main__':
+    main()
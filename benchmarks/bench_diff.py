@@ -0,0 +1,101 @@
+"""Micro-benchmark of diff_playlists against the old set-based compare_playlists
+
+Run from the repository root:
+
+    python benchmarks/bench_diff.py [--sizes 1000,10000,50000] [--repeat 5]
+"""
+import os
+import sys
+import random
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diff import diff_playlists
+from track import Track
+
+
+def legacy_compare_playlists(old_tracks, new_tracks):
+    """compare_playlists as it was before the diff engine, kept as the baseline"""
+    old_ids = {track['videoId'] for track in old_tracks if track.get('videoId')}
+    new_ids = {track['videoId'] for track in new_tracks if track.get('videoId')}
+
+    added_ids = new_ids - old_ids
+    removed_ids = old_ids - new_ids
+
+    added_songs = [track for track in new_tracks if track['videoId'] in added_ids]
+
+    removed_songs = []
+    for track in old_tracks:
+        if track['videoId'] in removed_ids:
+            removed_songs.append({
+                'videoId': track.get('videoId'),
+                'title': track.get('title', 'Unknown Title'),
+                'artists': track.get('artists', 'Unknown Artist'),
+                'thumbnail': track.get('thumbnail', None)
+            })
+    return added_songs, removed_songs
+
+
+def make_track(index):
+    return Track(
+        f'vid{index:08d}',
+        f'Song {index}',
+        f'Artist {index % 500}',
+        f'https://lh3.googleusercontent.com/{index:08d}=w544-h544',
+    )
+
+
+def make_scenarios(size, rng):
+    """(name, old, new) pairs for a playlist of the given size"""
+    old = [make_track(i) for i in range(size)]
+
+    churn = list(old)
+    for _ in range(max(1, size // 100)):
+        churn.pop(rng.randrange(len(churn)))
+    for i in range(max(1, size // 100)):
+        churn.insert(rng.randrange(len(churn) + 1), make_track(size + i))
+
+    moved = list(old)
+    for _ in range(max(1, size // 100)):
+        moved.insert(rng.randrange(len(moved)), moved.pop(rng.randrange(len(moved))))
+
+    shuffled = list(old)
+    rng.shuffle(shuffled)
+
+    return [
+        ('unchanged', old, list(old)),
+        ('1% churn', old, churn),
+        ('1% moved', old, moved),
+        ('shuffled', old, shuffled),
+    ]
+
+
+def best_of(func, old, new, repeat):
+    timer = timeit.Timer(lambda: func(old, new))
+    return min(timer.repeat(repeat=repeat, number=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'tracks':>8} {'scenario':<10} {'legacy ms':>10} {'diff ms':>10} {'ratio':>7}")
+    for size in (int(value) for value in args.sizes.split(',')):
+        for name, old, new in make_scenarios(size, rng):
+            # The old function worked on the dicts tracks used to be
+            legacy = best_of(
+                legacy_compare_playlists,
+                [track.to_dict() for track in old], [track.to_dict() for track in new], args.repeat
+            )
+            current = best_of(diff_playlists, old, new, args.repeat)
+            print(f"{size:>8} {name:<10} {legacy * 1000:>10.2f} {current * 1000:>10.2f} {current / legacy:>6.2f}x")
+
+
+if __name__ == '__main__':
+    main()
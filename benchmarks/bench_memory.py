@@ -0,0 +1,76 @@
+"""Memory footprint of in-memory playlist snapshots: per-track dicts vs Track records
+
+Run from the repository root:
+
+    python benchmarks/bench_memory.py [--playlists 20000] [--tracks 50]
+"""
+import os
+import sys
+import gc
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from track import Track
+
+
+def raw_fields(rng, artists, albums):
+    """Fresh strings for one track, as parsing a response or a database row produces"""
+    index = rng.randrange(10 ** 8)
+    album = rng.randrange(albums)
+    return (
+        f'vid{index:08d}',
+        f'Song {index}',
+        f'Artist {rng.randrange(artists)}',
+        f'https://lh3.googleusercontent.com/album{album:06d}=w544-h544-l90-rj',
+    )
+
+
+def make_dict(fields):
+    video_id, title, artists, thumbnail = fields
+    return {'videoId': video_id, 'title': title, 'artists': artists, 'thumbnail': thumbnail}
+
+
+def make_track(fields):
+    return Track(*fields)
+
+
+def measure(build, playlists, tracks, seed, artists, albums):
+    """Bytes allocated to hold every snapshot built with build(fields)"""
+    rng = random.Random(seed)
+    gc.collect()
+    tracemalloc.start()
+    snapshots = {
+        f'PL{number:06d}': [build(raw_fields(rng, artists, albums)) for _ in range(tracks)]
+        for number in range(playlists)
+    }
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del snapshots
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--playlists', type=int, default=20000)
+    parser.add_argument('--tracks', type=int, default=50, help='tracks per playlist')
+    parser.add_argument('--artists', type=int, default=5000, help='distinct artists across all playlists')
+    parser.add_argument('--albums', type=int, default=20000, help='distinct thumbnails across all playlists')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    total_tracks = args.playlists * args.tracks
+    print(f"{args.playlists} playlists x {args.tracks} tracks = {total_tracks} tracks held in memory")
+    print(f"{'format':<8} {'total MiB':>10} {'per playlist KiB':>17} {'per track B':>12}")
+    results = {}
+    for name, build in (('dict', make_dict), ('Track', make_track)):
+        size = measure(build, args.playlists, args.tracks, args.seed, args.artists, args.albums)
+        results[name] = size
+        print(f"{name:<8} {size / 2 ** 20:>10.1f} {size / args.playlists / 1024:>17.2f} {size / total_tracks:>12.0f}")
+    print(f"Track records use {results['Track'] / results['dict']:.0%} of the dict footprint")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Cold start benchmark: time from process launch to the first handled update
+
+Run from the repository root:
+
+    python benchmarks/bench_startup.py [--runs 5] [--playlists 50] [--size 1000]
+
+Every run starts a fresh Python process that imports bot.py, builds the real
+Application with a fake connection to Telegram (benchmarks/fakes.py),
+runs its startup hook and handles a /status update straight away, as after
+a restart with updates already waiting. Reported per phase, in ms since the
+process was launched:
+
+    python    interpreter up
+    import    bot.py imported
+    ready     application initialized and startup hook returned
+    handled   /status reply sent
+    preload   every saved snapshot loaded into memory
+    ytmusic   the deferred YTMusic client built (not needed for any of the above)
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+PHASES = ('python', 'import', 'ready', 'handled', 'preload', 'ytmusic')
+
+
+def playlist_ids(count):
+    return [f'PLstart{number:04d}' for number in range(count)]
+
+
+def prepare(args, workdir):
+    """A database with a saved snapshot and one subscriber for every playlist"""
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, BENCH_DIR)
+    from fakes import SyntheticPlaylist
+    from store import StateStore
+    from track import Track
+
+    store = StateStore(os.path.join(workdir, 'bot_state.db'))
+    for chat_id, playlist_id in enumerate(playlist_ids(args.playlists), 1):
+        playlist = SyntheticPlaylist(playlist_id, args.size, seed=args.seed)
+        tracks = [
+            Track(track['videoId'], track['title'], track['artists'][0]['name'], track['thumbnails'][-1]['url'])
+            for track in playlist.tracks
+        ]
+        store.save_snapshot(playlist_id, tracks)
+        store.add_subscriber(chat_id)
+        store.follow_playlist(chat_id, playlist_id)
+    store.close()
+
+
+async def child_main(args, launched, timings):
+    started = time.time()
+    timings['python'] = started - launched
+
+    import bot
+    timings['import'] = time.time() - launched
+
+    from telegram import Update
+    from telegram.ext import Application
+    from fakes import FakeTelegramRequest
+
+    request = FakeTelegramRequest()
+    application = bot.build_application(Application.builder().token('1:benchmark').request(request))
+    await application.initialize()
+    await application.post_init(application)
+    timings['ready'] = time.time() - launched
+
+    update = Update.de_json({
+        'update_id': 1,
+        'message': {
+            'message_id': 1, 'date': int(time.time()), 'text': '/status',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 7}],
+            'chat': {'id': 1, 'type': 'private'}, 'from': {'id': 1, 'is_bot': False, 'first_name': 'Bench'},
+        },
+    }, application.bot)
+    await application.process_update(update)
+    timings['handled'] = (request.first_sent_at or time.time()) - launched
+
+    while bot.saved_snapshots.stats()['entries'] < args.playlists:
+        await asyncio.sleep(0.005)
+    timings['preload'] = time.time() - launched
+
+    build_started = time.perf_counter()
+    bot.get_ytmusic()
+    timings['ytmusic'] = time.perf_counter() - build_started
+
+
+def run_child(args):
+    launched = float(os.environ['BENCH_LAUNCHED'])
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, BENCH_DIR)
+    timings = {}
+    asyncio.run(child_main(args, launched, timings))
+    print(json.dumps(timings), flush=True)
+    # Background polling would keep the loop busy; the measurement is done
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--playlists', type=int, default=50, help='followed playlists with a saved snapshot')
+    parser.add_argument('--size', type=int, default=1000, help='songs per playlist')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args)
+
+    with tempfile.TemporaryDirectory(prefix='ytm-startup-') as workdir:
+        prepare(args, workdir)
+        env = dict(
+            os.environ,
+            DATABASE_FILE=os.path.join(workdir, 'bot_state.db'),
+            THUMBNAIL_CACHE_DIR=os.path.join(workdir, 'thumbnail_cache'),
+            YOUTUBE_PLAYLIST_ID=playlist_ids(1)[0],
+            LOG_LEVEL='ERROR',
+            POLL_WORKERS='0',
+            WEBHOOK_URL='',
+        )
+        command = [sys.executable, os.path.abspath(__file__), '--child', '--playlists', str(args.playlists)]
+
+        print(f"{args.playlists} playlists x {args.size} songs saved, {args.runs} cold starts")
+        print(f"{'run':>4} " + ' '.join(f'{phase + " ms":>11}' for phase in PHASES))
+        results = []
+        for run in range(1, args.runs + 1):
+            env['BENCH_LAUNCHED'] = repr(time.time())
+            output = subprocess.run(command, env=env, cwd=workdir, capture_output=True, text=True, check=True).stdout
+            timings = json.loads(output.strip().splitlines()[-1])
+            results.append(timings)
+            print(f"{run:>4} " + ' '.join(f'{timings[phase] * 1000:>11.0f}' for phase in PHASES))
+        print(f"{'med':>4} " + ' '.join(
+            f'{statistics.median(timings[phase] for timings in results) * 1000:>11.0f}' for phase in PHASES
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""Offline stand-ins for YouTube Music and the Telegram Bot, plus synthetic playlists
+
+Used by the benchmarks so every performance change can be measured without
+network access. Latency, errors and rate limiting are all configurable and
+seeded, so two runs with the same arguments do the same work.
+"""
+import json
+import time
+import random
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from telegram.error import NetworkError, RetryAfter
+from telegram.request import BaseRequest
+
+
+class SyntheticPlaylist:
+    """A playlist of raw ytmusicapi-style tracks that changes by a script
+
+    Every step() removes and inserts churn * size songs at random positions
+    and moves `moves` songs, like a curator editing the playlist between two
+    checks. Thumbnails come from a pool of albums, so artwork repeats as it
+    does on real playlists.
+    """
+
+    def __init__(self, playlist_id, size, churn=0.01, moves=0, albums=500, artists=300, seed=0):
+        self.playlist_id = playlist_id
+        self.churn = churn
+        self.moves = moves
+        self.albums = albums
+        self.artists = artists
+        self.rng = random.Random(f'{seed}:{playlist_id}')
+        self._next = 0
+        self.tracks = [self._new_track() for _ in range(size)]
+        self.steps = 0
+
+    def _new_track(self):
+        index = self._next
+        self._next += 1
+        album = self.rng.randrange(self.albums)
+        return {
+            'videoId': f'{self.playlist_id[-6:]}{index:07d}',
+            'title': f'Song {index}',
+            'artists': [{'name': f'Artist {self.rng.randrange(self.artists)}', 'id': None}],
+            'thumbnails': [
+                {'url': thumbnail_url(album, 60), 'width': 60, 'height': 60},
+                {'url': thumbnail_url(album, 544), 'width': 544, 'height': 544},
+            ],
+            'duration': '3:30',
+        }
+
+    def step(self):
+        """Apply one round of scripted churn; returns (added, removed, moved) counts"""
+        changes = max(1, int(len(self.tracks) * self.churn)) if self.churn else 0
+        removed = min(changes, len(self.tracks))
+        for _ in range(removed):
+            self.tracks.pop(self.rng.randrange(len(self.tracks)))
+        for _ in range(changes):
+            self.tracks.insert(self.rng.randrange(len(self.tracks) + 1), self._new_track())
+        moved = min(self.moves, len(self.tracks))
+        for _ in range(moved):
+            track = self.tracks.pop(self.rng.randrange(len(self.tracks)))
+            self.tracks.insert(self.rng.randrange(len(self.tracks) + 1), track)
+        self.steps += 1
+        return changes, removed, moved
+
+
+def thumbnail_url(album, size):
+    return f'https://lh3.googleusercontent.com/fake-album-{album:05d}=w{size}-h{size}-l90-rj'
+
+
+def album_thumbnails(albums):
+    """Every square thumbnail URL the bot can pick from SyntheticPlaylist tracks"""
+    return [thumbnail_url(album, 544) for album in range(albums)]
+
+
+class FakeYTMusic:
+    """Serves SyntheticPlaylists the way YouTube Music's browse endpoint does
+
+    _send_request answers browse and continuation requests with raw
+    responses in the layout PlaylistPages walks, a header with the song
+    count and PAGE_SIZE songs per page, so the bot's whole fetch path
+    (upstream guard, fetch engine, page walk, ytmusicapi's item parser,
+    fingerprint) runs unchanged. With browse=False, browse requests get a
+    layout the page walker doesn't know and it falls back to get_playlist().
+    With truncate_after, continuation requests after that many pages come
+    back empty, as when YouTube cuts a playlist short.
+
+    Every request sleeps for latency seconds (plus up to jitter) in the
+    calling worker thread, and fails with an HTTP 503 for error_rate of the
+    requests.
+    """
+
+    PAGE_SIZE = 100
+
+    def __init__(self, playlists, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, browse=True,
+                 truncate_after=None):
+        self.playlists = {playlist.playlist_id: playlist for playlist in playlists}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.browse = browse
+        self.truncate_after = truncate_after
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            failed = self.rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise server_error('Server returned HTTP 503: Service Unavailable.')
+
+    def _playlist(self, playlist_id):
+        playlist = self.playlists.get(playlist_id)
+        if playlist is None:
+            raise server_error('Server returned HTTP 404: Not Found.')
+        return playlist
+
+    def _send_request(self, endpoint, body):
+        self._call()
+        if 'continuation' in body:
+            playlist_id, offset = body['continuation'].rsplit(':', 1)
+            offset = int(offset)
+            if self.truncate_after is not None and offset >= self.truncate_after * self.PAGE_SIZE:
+                return {}
+            items = self._page(self._playlist(playlist_id), offset)
+            return {'onResponseReceivedActions': [{'appendContinuationItemsAction': {'continuationItems': items}}]}
+        if not self.browse:
+            return {}
+        playlist = self._playlist(body['browseId'][2:])
+        header = {'musicResponsiveHeaderRenderer': {
+            'title': {'runs': [{'text': playlist.playlist_id}]},
+            'secondSubtitle': {'runs': [{'text': f'{len(playlist.tracks)} songs'}, {'text': ' • '}, {'text': '1 hour'}]},
+        }}
+        shelf = {'musicPlaylistShelfRenderer': {'contents': self._page(playlist, 0)}}
+        return {'contents': {'twoColumnBrowseResultsRenderer': {
+            'tabs': [{'tabRenderer': {'content': {'sectionListRenderer': {'contents': [header]}}}}],
+            'secondaryContents': {'sectionListRenderer': {'contents': [shelf]}},
+        }}}
+
+    def _page(self, playlist, offset):
+        """Raw list items of one page, ending in a continuation if more follow"""
+        items = [render_track(track) for track in playlist.tracks[offset:offset + self.PAGE_SIZE]]
+        if offset + self.PAGE_SIZE < len(playlist.tracks):
+            token = f'{playlist.playlist_id}:{offset + self.PAGE_SIZE}'
+            items.append({'continuationItemRenderer': {'continuationEndpoint': {'continuationCommand': {'token': token}}}})
+        return items
+
+    def get_playlist(self, playlistId, limit=100, related=False, suggestions_limit=0):
+        self._call()
+        playlist = self._playlist(playlistId)
+        tracks = playlist.tracks if limit is None else playlist.tracks[:limit]
+        return {'id': playlistId, 'trackCount': len(playlist.tracks), 'tracks': [dict(track) for track in tracks]}
+
+
+def server_error(message):
+    # Imported here so the startup benchmark doesn't load ytmusicapi early
+    from ytmusicapi.exceptions import YTMusicServerError
+    return YTMusicServerError(message)
+
+
+def render_track(track):
+    """A SyntheticPlaylist track as the musicResponsiveListItemRenderer ytmusicapi parses it from"""
+    def column(text, endpoint=None):
+        run = {'text': text}
+        if endpoint:
+            run['navigationEndpoint'] = endpoint
+        return {'musicResponsiveListItemFlexColumnRenderer': {'text': {'runs': [run]}}}
+
+    video_id = track['videoId']
+    return {'musicResponsiveListItemRenderer': {
+        'flexColumns': [
+            column(track['title'], {'watchEndpoint': {'videoId': video_id}}),
+            column(', '.join(artist['name'] for artist in track['artists'])),
+        ],
+        'fixedColumns': [{'musicResponsiveListItemFixedColumnRenderer': {'text': {'runs': [{'text': track['duration']}]}}}],
+        'thumbnail': {'musicThumbnailRenderer': {'thumbnail': {'thumbnails': track['thumbnails']}}},
+        'overlay': {'musicItemThumbnailOverlayRenderer': {'content': {'musicPlayButtonRenderer': {
+            'playNavigationEndpoint': {'watchEndpoint': {'videoId': video_id}},
+        }}}},
+    }}
+
+
+class FakeBot:
+    """Records what the bot sends instead of calling Telegram
+
+    Each call waits latency seconds. One call in rate_limit_every raises
+    RetryAfter(retry_after), and error_rate of them raise a NetworkError,
+    which the dispatcher retries.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit_every=0, retry_after=1, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.messages = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.recipients = set()
+
+    async def _call(self, chat_id, messages=1):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_limit_every and self.calls % self.rate_limit_every == 0:
+            self.rate_limited += 1
+            raise RetryAfter(self.retry_after)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.errors += 1
+            raise NetworkError('Fake network error')
+        self.messages += messages
+        self.recipients.add(chat_id)
+
+    @staticmethod
+    def _photo_message():
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f'fake-file-{random.getrandbits(48):x}')])
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._call(chat_id)
+        return SimpleNamespace(text=text)
+
+    async def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        await self._call(chat_id)
+        return self._photo_message()
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        await self._call(chat_id, len(media))
+        return [self._photo_message() for _ in media]
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers Bot API calls locally, for benchmarks that run a real Application
+
+    getMe and the send methods get minimal valid results; everything else
+    gets True. The time of the first sendMessage is kept in first_sent_at.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self.first_sent_at = None
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        endpoint = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls.append(endpoint)
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+        elif endpoint.startswith('send'):
+            if endpoint == 'sendMessage' and self.first_sent_at is None:
+                self.first_sent_at = time.time()
+            self._message_id += 1
+            result = {
+                'message_id': self._message_id, 'date': int(time.time()),
+                'chat': {'id': parameters.get('chat_id', 0), 'type': 'private'},
+                'text': parameters.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
@@ -1,92 +1,130 @@
 import os
+import html
 import time
 import asyncio
-import traceback
+import logging
+import threading
+import multiprocessing
 from dotenv import load_dotenv
-from ytmusicapi import YTMusic
 from telegram import Update, Bot, InputMediaPhoto
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler
-from keep_alive import keep_alive
-import json
-import requests
-from io import BytesIO
+from webhook import WEBHOOK_URL, run_webhook
+from fetcher import fetch_engine
+from cache import snapshot_cache, saved_snapshots
+from store import state_store
+from diff import diff_playlists, playlist_fingerprint, Fingerprint
+from dispatcher import FanoutDispatcher, is_stale_file_id
+from images import image_fetcher
+from batching import plan_notifications, format_digest_pages, playlist_line
+from scheduler import PollScheduler
+from follows import FollowIndex, MAX_FOLLOWED_PLAYLISTS
+from track import Track
+from resilience import ytmusic_upstream, is_transient, IncompleteResponseError, UpstreamUnavailable
+from metrics import (
+    metrics, fetch_seconds, playlist_fetch_seconds, fetch_errors, tracks_parsed, diff_seconds,
+    poll_cycle_seconds, record_poll_success, monitor_loop_lag
+)
+from tracing import span, setup_logging, current_trace_id, cycle_profiler
+from shards import POLL_WORKERS, Lease, ShardPool, shard_of
 from urllib.parse import urlparse, parse_qs
 
 # Load environment variables
 load_dotenv()
+setup_logging()
+log = logging.getLogger('bot')
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 YOUTUBE_PLAYLIST_ID = os.getenv('YOUTUBE_PLAYLIST_ID')
 CHECK_INTERVAL = int(os.getenv('CHECK_INTERVAL', 300))
 # Conversation states
 WAITING_FOR_PLAYLIST = 1
+# Every handler is a command or a text reply, so nothing but messages is requested
+ALLOWED_UPDATES = [Update.MESSAGE]
 
-# Initialize APIs with optional authentication
-try:
-    if os.path.exists('headers_auth.json'):
-        ytmusic = YTMusic('headers_auth.json')
-        print("✅ Using authenticated YTMusic")
-    else:
-        ytmusic = YTMusic()
-        print("✅ Using unauthenticated YTMusic")
-except Exception as e:
-    print(f"⚠️ Error initializing YTMusic: {e}")
-    ytmusic = YTMusic()
+# YouTube Music client, built by get_ytmusic() on the first fetch so a
+# restart can take updates before it's needed
+ytmusic = None
+ytmusic_lock = threading.Lock()
+
+def get_ytmusic():
+    """The YTMusic client, created on first use with optional authentication"""
+    global ytmusic
+    with ytmusic_lock:
+        if ytmusic is None:
+            from ytmusicapi import YTMusic
+            try:
+                if os.path.exists('headers_auth.json'):
+                    ytmusic = YTMusic('headers_auth.json')
+                    log.info("✅ Using authenticated YTMusic")
+                else:
+                    ytmusic = YTMusic()
+                    log.info("✅ Using unauthenticated YTMusic")
+            except Exception as e:
+                log.warning(f"⚠️ Error initializing YTMusic: {e}")
+                ytmusic = YTMusic()
+        return ytmusic
+
+# Outbox delivery settings
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 1000))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+# Set whenever notifications are queued; the outbox worker waits on it
+outbox_ready = asyncio.Event()
+outbox_lock = asyncio.Lock()
+
+# Result of a check that found nothing to do
+EMPTY_DIFF = diff_playlists([], [])
 
-# Store files
-PLAYLIST_FILE = 'playlist_state.json'
-SUBSCRIBERS_FILE = 'subscribers.json'
-USER_PLAYLISTS_FILE = 'user_playlists.json'
+# Spreads playlist polls across each check interval
+poll_scheduler = PollScheduler(CHECK_INTERVAL)
+
+# Who follows which playlist, kept in memory so routing a diff doesn't scan every chat
+follow_index = FollowIndex(state_store, YOUTUBE_PLAYLIST_ID)
+
+def drop_unreachable_chat(chat_id):
+    """Unsubscribe a chat that blocked the bot or no longer exists"""
+    follow_index.unsubscribe(chat_id)
+    state_store.clear_notifications(chat_id)
+
+# Rate-limited concurrent delivery of notifications
+dispatcher = FanoutDispatcher(on_blocked=drop_unreachable_chat)
 
 def load_subscribers():
     """Load list of subscribed chat IDs"""
     try:
-        if os.path.exists(SUBSCRIBERS_FILE):
-            with open(SUBSCRIBERS_FILE, 'r') as f:
-                return json.load(f)
-        return []
+        return follow_index.subscribers()
     except Exception as e:
-        print(f"Error loading subscribers: {e}")
+        log.error(f"Error loading subscribers: {e}")
         return []
 
-def save_subscribers(subscribers):
-    """Save list of subscribed chat IDs"""
-    try:
-        with open(SUBSCRIBERS_FILE, 'w') as f:
-            json.dump(subscribers, f, indent=2)
-    except Exception as e:
-        print(f"Error saving subscribers: {e}")
+def get_chat_playlists(chat_id):
+    """Playlists a chat follows: the default one first, then the ones it added"""
+    return follow_index.playlists_of(chat_id)
 
-def load_user_playlists():
-    """Load user-specific playlist IDs"""
-    try:
-        if os.path.exists(USER_PLAYLISTS_FILE):
-            with open(USER_PLAYLISTS_FILE, 'r') as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        print(f"Error loading user playlists: {e}")
-        return {}
-
-def save_user_playlists(playlists):
-    """Save user-specific playlist IDs"""
-    try:
-        with open(USER_PLAYLISTS_FILE, 'w') as f:
-            json.dump(playlists, f, indent=2)
-    except Exception as e:
-        print(f"Error saving user playlists: {e}")
+def extract_playlist_id(text):
+    """Playlist ID from a YouTube Music URL or a bare ID"""
+    playlist_id = text.strip()
+    if 'list=' in playlist_id:
+        # Extract from URL
+        try:
+            query_params = parse_qs(urlparse(playlist_id).query)
+            if 'list' in query_params:
+                playlist_id = query_params['list'][0]
+                log.debug(f"Extracted playlist ID from URL: {playlist_id}")
+        except Exception as e:
+            log.error(f"Error parsing URL: {e}")
+    return playlist_id.strip()
 
-def get_user_playlist_id(chat_id):
-    """Get playlist ID for specific user, fallback to default"""
-    user_playlists = load_user_playlists()
-    return user_playlists.get(str(chat_id), YOUTUBE_PLAYLIST_ID)
+def is_playlist_id(playlist_id):
+    """Playlist IDs usually start with PL, RDCLAK or OLAK"""
+    return playlist_id.startswith(('PL', 'RDCLAK', 'OLAK'))
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors"""
-    print(f"Exception while handling an update: {context.error}")
+    log.error("Exception while handling an update", exc_info=context.error)
     
     # Handle Conflict errors (multiple bot instances)
     if "Conflict" in str(context.error):
-        print("⚠️ Conflict detected - another bot instance might be running")
+        log.warning("⚠️ Conflict detected - another bot instance might be running")
         return
     
     # Notify user if update is available
@@ -97,16 +135,13 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='HTML'
             )
         except Exception as e:
-            print(f"Failed to send error message: {e}")
+            log.error(f"Failed to send error message: {e}")
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command - Subscribe user to notifications"""
     chat_id = update.effective_chat.id
-    subscribers = load_subscribers()
     
-    if chat_id not in subscribers:
-        subscribers.append(chat_id)
-        save_subscribers(subscribers)
+    if follow_index.subscribe(chat_id):
         await update.message.reply_text(
             "✅ <b>Welcome to YouTube Music Playlist Monitor!</b>\n\n"
             "You are now subscribed to playlist updates.\n"
@@ -116,13 +151,16 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "/stop - Unsubscribe from notifications\n"
             "/status - Check current status\n"
             "/check - Force check playlist now\n"
-            "/setplaylist - Set your custom playlist\n"
+            "/setplaylist - Follow another playlist\n"
+            "/unfollow - Stop following a playlist\n"
+            "/list - List the playlists you follow\n"
             "/reset - Reset your playlist state\n"
+            "/history - Show recent playlist changes\n"
             "/help - Show detailed help\n\n"
             "Use /help for more information! 📚",
             parse_mode='HTML'
         )
-        print(f"New subscriber: {chat_id}")
+        log.info(f"New subscriber: {chat_id}")
     else:
         await update.message.reply_text(
             "ℹ️ You're already subscribed to playlist updates!",
@@ -132,23 +170,39 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /stop command - Unsubscribe user from notifications"""
     chat_id = update.effective_chat.id
-    subscribers = load_subscribers()
     
-    if chat_id in subscribers:
-        subscribers.remove(chat_id)
-        save_subscribers(subscribers)
+    if follow_index.unsubscribe(chat_id):
         await update.message.reply_text(
             "👋 You have been unsubscribed from playlist updates.\n"
             "Send /start anytime to subscribe again!",
             parse_mode='HTML'
         )
-        print(f"Unsubscribed: {chat_id}")
+        log.info(f"Unsubscribed: {chat_id}")
     else:
         await update.message.reply_text(
             "ℹ️ You're not currently subscribed.",
             parse_mode='HTML'
         )
 
+def format_upstream_status():
+    """One-line circuit breaker state for /status"""
+    breaker_stats = ytmusic_upstream.breaker.stats()
+    if breaker_stats['state'] == 'open':
+        return f"⛔ Unavailable, retrying in {breaker_stats['retry_in']:.0f}s (showing saved state)"
+    if breaker_stats['state'] == 'half_open':
+        return "🟡 Recovering"
+    return "✅ OK"
+
+async def get_track_count(playlist_id):
+    """Songs in a playlist, from memory or saved state when possible"""
+    playlist_tracks = snapshot_cache.get(playlist_id)
+    if playlist_tracks is None and state_store.has_snapshot(playlist_id):
+        # The state from the last check answers without waiting on YouTube Music
+        playlist_tracks = load_previous_state(playlist_id)
+    if playlist_tracks is None:
+        playlist_tracks = await fetch_playlist_tracks(playlist_id)
+    return len(playlist_tracks) if playlist_tracks else None
+
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /status command - Show current status"""
     chat_id = update.effective_chat.id
@@ -157,34 +211,35 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     is_subscribed = chat_id in subscribers
     total_subscribers = len(subscribers)
     
-    user_playlist_id = get_user_playlist_id(chat_id)
-    playlist_tracks = get_playlist_tracks(user_playlist_id)
-    track_count = len(playlist_tracks) if playlist_tracks else "Unknown"
-    
-    has_custom_playlist = user_playlist_id != YOUTUBE_PLAYLIST_ID
+    playlist_ids = get_chat_playlists(chat_id)
+    track_counts = await asyncio.gather(*(get_track_count(playlist_id) for playlist_id in playlist_ids))
     
     status_message = (
         f"📊 <b>Bot Status</b>\n\n"
         f"Your Status: {'✅ Subscribed' if is_subscribed else '❌ Not Subscribed'}\n"
         f"Total Subscribers: {total_subscribers}\n"
-        f"Your Playlist Songs: {track_count}\n"
-        f"Custom Playlist: {'✅ Yes' if has_custom_playlist else '❌ Using Default'}\n"
-        f"Check Interval: {CHECK_INTERVAL // 60} minutes\n\n"
+        f"YouTube Music: {format_upstream_status()}\n\n"
+        f"<b>Your Playlists</b> (checked adaptively)\n"
     )
     
-    if has_custom_playlist:
-        status_message += f"Your Playlist ID: <code>{user_playlist_id}</code>\n\n"
+    for playlist_id, track_count in zip(playlist_ids, track_counts):
+        # Quiet playlists are checked less often, busy ones more often
+        check_interval = poll_scheduler.interval_for(playlist_id) or CHECK_INTERVAL
+        label = "Default playlist" if playlist_id == YOUTUBE_PLAYLIST_ID else f"<code>{playlist_id}</code>"
+        status_message += (
+            f"• {label}: {track_count if track_count is not None else 'Unknown'} songs, "
+            f"every {round(check_interval / 60)} min\n"
+        )
     
-    status_message += "Use /setplaylist to change your playlist!"
+    status_message += "\nUse /setplaylist to follow another playlist!"
     
     await update.message.reply_text(status_message, parse_mode='HTML')
 
 async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /check command - Manually trigger playlist check"""
     chat_id = update.effective_chat.id
-    subscribers = load_subscribers()
     
-    if chat_id not in subscribers:
+    if not follow_index.is_subscribed(chat_id):
         await update.message.reply_text(
             "⚠️ Please subscribe first using /start",
             parse_mode='HTML'
@@ -193,8 +248,8 @@ async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text("🔄 Checking playlist for updates...", parse_mode='HTML')
     
-    # Perform check for this user only
-    await check_playlist_for_user(chat_id, context.bot)
+    # Perform check for this user's playlists only
+    await check_playlists_for_user(chat_id, context.bot)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command - Show help information"""
@@ -207,19 +262,24 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/stop - Unsubscribe from notifications\n"
         "/status - View bot status and your subscription info\n"
         "/check - Manually check for playlist updates now\n"
-        "/setplaylist - Set your custom YouTube Music playlist\n"
-        "/reset - Reset your playlist state (fixes sync issues)\n"
+        "/setplaylist - Follow another YouTube Music playlist\n"
+        "/unfollow &lt;playlist&gt; - Stop following a playlist\n"
+        "/list - List the playlists you follow\n"
+        "/reset [playlist] - Reset your playlist state (fixes sync issues)\n"
+        "/history [playlist] - Show the latest songs added or removed\n"
         "/help - Show this help message\n\n"
         "<b>⚙️ How It Works:</b>\n\n"
-        "• The bot checks your playlist every 5 minutes\n"
+        f"• Each playlist is checked every {poll_scheduler.min_interval / 60:g} to "
+        f"{poll_scheduler.max_interval / 60:g} minutes: more often right after it changes, "
+        "less often while it stays the same (/status shows the current interval)\n"
         "• You'll get a notification with album art when songs are added ➕\n"
         "• You'll get a notification when songs are removed ➖\n"
         "• Each notification includes song title, artist, and a direct link\n"
-        "• Each user can set their own custom playlist!\n\n"
+        f"• Each user can follow up to {MAX_FOLLOWED_PLAYLISTS} playlists of their own!\n\n"
         "<b>💡 Tips:</b>\n\n"
         "• Use /check to test the bot immediately\n"
         "• Use /status to see how many songs are being tracked\n"
-        "• Use /setplaylist to monitor your own playlist\n"
+        "• Use /setplaylist to monitor your own playlists\n"
         "• Use /reset if you see incorrect notifications\n"
         "• The bot runs 24/7 so you never miss updates!\n\n"
         "Enjoy your music tracking! 🎶"
@@ -227,24 +287,65 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(help_text, parse_mode='HTML')
 
+def select_playlists(chat_id, args):
+    """The chat's playlists, or just the one named in the command arguments
+
+    Returns None if the named playlist isn't one the chat follows.
+    """
+    playlist_ids = get_chat_playlists(chat_id)
+    if not args:
+        return playlist_ids
+    playlist_id = extract_playlist_id(args[0])
+    return [playlist_id] if playlist_id in playlist_ids else None
+
+async def reply_not_following(update: Update):
+    await update.message.reply_text(
+        "ℹ️ You don't follow that playlist. Use /list to see the ones you do.",
+        parse_mode='HTML'
+    )
+
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /reset command - Reset user's playlist state"""
+    """Handle /reset command - Reset the state of the user's playlists
+
+    Saved state is shared by every chat following a playlist, so it is only
+    deleted for playlists no other chat follows. On shared playlists the
+    chat's queued notifications are dropped instead, and everyone else
+    keeps being told about changes.
+    """
     chat_id = update.effective_chat.id
-    user_state_file = f'playlist_state_{chat_id}.json'
+    playlist_ids = select_playlists(chat_id, context.args)
+    if playlist_ids is None:
+        await reply_not_following(update)
+        return
     
-    # Delete the user's state file if it exists
     try:
-        if os.path.exists(user_state_file):
-            os.remove(user_state_file)
-            await update.message.reply_text(
-                "✅ <b>Playlist state reset successfully!</b>\n\n"
-                "Your saved playlist state has been cleared.\n\n"
-                "Next time you use /check, the bot will save a fresh state "
-                "and only detect changes from that point forward.\n\n"
-                "Try /check now to establish a new baseline!",
-                parse_mode='HTML'
-            )
-            print(f"Reset state for user: {chat_id}")
+        reset = shared = 0
+        for playlist_id in playlist_ids:
+            if set(follow_index.recipients(playlist_id)) - {chat_id}:
+                state_store.clear_notifications(chat_id, playlist_id)
+                shared += 1
+            elif state_store.delete_snapshot(playlist_id):
+                snapshot_cache.invalidate(playlist_id)
+                saved_snapshots.invalidate(playlist_id)
+                reset += 1
+        if reset or shared:
+            lines = ["✅ <b>Playlist state reset successfully!</b>\n"]
+            if reset:
+                lines.append(
+                    f"The saved state of {reset} playlist{'s' if reset > 1 else ''} has been cleared. "
+                    "Next time you use /check, the bot will save a fresh state "
+                    "and only detect changes from that point forward.\n"
+                )
+            if shared:
+                lines.append(
+                    f"{shared} playlist{'s are' if shared > 1 else ' is'} followed by other chats too, so "
+                    f"{'their' if shared > 1 else 'its'} saved state is kept; notifications still waiting "
+                    "for you have been dropped.\n"
+                )
+            if reset:
+                lines.append("Try /check now to establish a new baseline!")
+            await update.message.reply_text("\n".join(lines).rstrip(), parse_mode='HTML')
+            log.info(f"Reset state of {reset} playlists ({shared} shared) for user: {chat_id}")
         else:
             await update.message.reply_text(
                 "ℹ️ No saved state found. Nothing to reset.\n\n"
@@ -252,16 +353,52 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='HTML'
             )
     except Exception as e:
-        print(f"Error resetting state for {chat_id}: {e}")
+        log.error(f"Error resetting state for {chat_id}: {e}")
         await update.message.reply_text(
             "❌ Failed to reset state. Please try again.",
             parse_mode='HTML'
         )
 
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /history command - Show recent changes to the user's playlists"""
+    chat_id = update.effective_chat.id
+    playlist_ids = select_playlists(chat_id, context.args)
+    if playlist_ids is None:
+        await reply_not_following(update)
+        return
+    
+    # Newest first across every playlist the chat follows
+    changes = sorted(
+        (dict(change, playlist_id=playlist_id)
+         for playlist_id in playlist_ids for change in state_store.get_change_history(playlist_id, limit=15)),
+        key=lambda change: change['recorded_at'], reverse=True
+    )[:15]
+    
+    if not changes:
+        await update.message.reply_text(
+            "ℹ️ No changes recorded for your playlists yet.",
+            parse_mode='HTML'
+        )
+        return
+    
+    lines = ["🕘 <b>Recent Playlist Changes</b>\n"]
+    for change in changes:
+        emoji = {'added': "➕", 'removed': "➖"}.get(change['action'], "🔀")
+        when = time.strftime('%Y-%m-%d %H:%M', time.gmtime(change['recorded_at']))
+        where = f" in <code>{change['playlist_id']}</code>" if len(playlist_ids) > 1 else ""
+        lines.append(f"{emoji} {html.escape(change['title'] or 'Unknown Title')} - "
+                     f"{html.escape(change['artists'] or 'Unknown Artist')}{where} <i>({when} UTC)</i>")
+    
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
 async def setplaylist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /setplaylist command - Start playlist setup conversation"""
+    if following_limit_reached(update.effective_chat.id):
+        await reply_following_limit(update)
+        return ConversationHandler.END
+    
     await update.message.reply_text(
-        "🎵 <b>Set Your YouTube Music Playlist</b>\n\n"
+        "🎵 <b>Follow a YouTube Music Playlist</b>\n\n"
         "Send me your YouTube Music playlist URL or ID.\n\n"
         "<b>Option 1 - Send the full URL:</b>\n"
         "Just copy and paste the entire URL from your browser.\n\n"
@@ -277,30 +414,27 @@ async def setplaylist_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     return WAITING_FOR_PLAYLIST
 
+def following_limit_reached(chat_id):
+    # The default playlist doesn't count against the limit
+    return len(get_chat_playlists(chat_id)) - 1 >= MAX_FOLLOWED_PLAYLISTS
+
+async def reply_following_limit(update: Update):
+    await update.message.reply_text(
+        f"⚠️ You already follow {MAX_FOLLOWED_PLAYLISTS} playlists, the most allowed.\n\n"
+        "Use /unfollow to make room for another one.",
+        parse_mode='HTML'
+    )
+
 async def receive_playlist_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Receive and validate playlist ID from user"""
     chat_id = update.effective_chat.id
     user_input = update.message.text.strip()
     
     # Extract playlist ID from URL if full URL is provided
-    playlist_id = user_input
-    if 'list=' in user_input:
-        # Extract from URL
-        try:
-            parsed_url = urlparse(user_input)
-            query_params = parse_qs(parsed_url.query)
-            if 'list' in query_params:
-                playlist_id = query_params['list'][0]
-                print(f"Extracted playlist ID from URL: {playlist_id}")
-        except Exception as e:
-            print(f"Error parsing URL: {e}")
-            playlist_id = user_input
-    
-    # Clean up the playlist ID
-    playlist_id = playlist_id.strip()
+    playlist_id = extract_playlist_id(user_input)
     
     # Validate playlist ID format (should start with PL, RDCLAK, or OLAK)
-    if not (playlist_id.startswith('PL') or playlist_id.startswith('RDCLAK') or playlist_id.startswith('OLAK')):
+    if not is_playlist_id(playlist_id):
         await update.message.reply_text(
             "❌ Invalid playlist ID format.\n\n"
             "Playlist IDs usually start with 'PL', 'RDCLAK', or 'OLAK'.\n"
@@ -309,13 +443,30 @@ async def receive_playlist_id(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return WAITING_FOR_PLAYLIST
     
-    # Try to fetch the playlist to validate it
+    if playlist_id in get_chat_playlists(chat_id):
+        await update.message.reply_text(
+            "ℹ️ You already follow this playlist. Use /list to see all of yours.",
+            parse_mode='HTML'
+        )
+        return ConversationHandler.END
+    
+    # Only the header and first page are fetched, so the answer doesn't
+    # wait on the whole playlist
     await update.message.reply_text("⏳ Validating playlist...", parse_mode='HTML')
     
     try:
-        test_tracks = get_playlist_tracks(playlist_id)
+        preview = await fetch_playlist_preview(playlist_id)
         
-        if test_tracks is None or len(test_tracks) == 0:
+        if preview is UPSTREAM_DOWN:
+            retry_in = ytmusic_upstream.breaker.retry_in
+            when = f"in about {retry_in:.0f}s" if retry_in else "in a moment"
+            await update.message.reply_text(
+                "⛔ <b>YouTube Music isn't responding right now</b>\n\n"
+                f"Your playlist couldn't be checked. Send it again {when}, or send /cancel to abort.",
+                parse_mode='HTML'
+            )
+            return WAITING_FOR_PLAYLIST
+        if preview is None or not preview[1]:
             await update.message.reply_text(
                 "❌ <b>Failed to access playlist</b>\n\n"
                 "This could mean:\n"
@@ -327,37 +478,29 @@ async def receive_playlist_id(update: Update, context: ContextTypes.DEFAULT_TYPE
                 parse_mode='HTML'
             )
             return WAITING_FOR_PLAYLIST
+        track_count, first_page = preview
         
-        # Save the playlist ID for this user
-        user_playlists = load_user_playlists()
-        user_playlists[str(chat_id)] = playlist_id
-        save_user_playlists(user_playlists)
+        # Another /setplaylist may have filled the last slot meanwhile
+        if following_limit_reached(chat_id):
+            await reply_following_limit(update)
+            return ConversationHandler.END
         
-        # Save initial state for this user's playlist
-        user_state_file = f'playlist_state_{chat_id}.json'
-        try:
-            with open(user_state_file, 'w', encoding='utf-8') as f:
-                json.dump(test_tracks, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Error saving user state: {e}")
+        # Add the playlist to the ones this user follows
+        follow_index.follow(chat_id, playlist_id)
+        
+        # The full initial state is fetched and saved in the background,
+        # unless another chat already tracks this playlist
+        if not state_store.has_snapshot(playlist_id):
+            build_baseline_later(playlist_id)
         
         # Prepare success message
+        songs = f"{track_count} songs" if track_count else f"{len(first_page)}+ songs"
         success_msg = (
-            f"✅ <b>Playlist Set Successfully!</b>\n\n"
-            f"🎵 Found {len(test_tracks)} songs in your playlist.\n"
+            f"✅ <b>Playlist Followed Successfully!</b>\n\n"
+            f"🎵 Found {songs} in your playlist.\n"
             f"📋 Playlist ID: <code>{playlist_id}</code>\n\n"
-        )
-        
-        # Add warning if track count is multiple of 100 (might be hitting limit)
-        if len(test_tracks) % 100 == 0 and len(test_tracks) >= 100:
-            success_msg += (
-                f"⚠️ <b>Note:</b> Fetched exactly {len(test_tracks)} songs. "
-                "If you have more songs, some might not be tracked due to API pagination.\n\n"
-            )
-        
-        success_msg += (
             "You will now receive notifications when songs are added or removed from this playlist.\n\n"
-            "Use /check to test it now!"
+            "Use /check to test it now, or /list to see every playlist you follow!"
         )
         
         await update.message.reply_text(success_msg, parse_mode='HTML')
@@ -366,12 +509,11 @@ async def receive_playlist_id(update: Update, context: ContextTypes.DEFAULT_TYPE
         
     except Exception as e:
         error_msg = str(e)
-        print(f"Error validating playlist: {type(e).__name__}: {error_msg}")
-        traceback.print_exc()
+        log.exception(f"Error validating playlist: {type(e).__name__}: {error_msg}")
         
         await update.message.reply_text(
             "❌ <b>Error validating playlist</b>\n\n"
-            f"Error: {error_msg}\n\n"
+            f"Error: {html.escape(error_msg)}\n\n"
             "Please check:\n"
             "• The playlist is public (not private)\n"
             "• The playlist ID is correct\n"
@@ -385,132 +527,347 @@ async def cancel_setplaylist(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Cancel the playlist setup"""
     await update.message.reply_text(
         "❌ Playlist setup cancelled.\n\n"
-        "Use /setplaylist anytime to set your playlist.",
+        "Use /setplaylist anytime to follow a playlist.",
         parse_mode='HTML'
     )
     return ConversationHandler.END
 
-def get_playlist_tracks(playlist_id=None):
-    """Fetch current tracks from YouTube Music playlist"""
-    try:
-        if playlist_id is None:
-            playlist_id = YOUTUBE_PLAYLIST_ID
-        
-        print(f"🔍 Fetching playlist: {playlist_id}")
-        
-        # Fetch the playlist with a high limit to get all tracks
-        # Setting limit to 5000 should handle most playlists
-        playlist = ytmusic.get_playlist(playlist_id, limit=5000)
-        
-        # Check if playlist is valid
-        if not playlist:
-            print("❌ Playlist returned None or empty")
-            return None
-        
-        # Check if tracks exist
-        if 'tracks' not in playlist:
-            print(f"❌ No 'tracks' key in playlist. Keys: {playlist.keys()}")
-            return None
-        
-        # Check if tracks is empty or None
-        if not playlist['tracks']:
-            print("⚠️ Playlist has no tracks")
-            return []
-        
-        track_count = len(playlist['tracks'])
-        print(f"📊 Processing {track_count} tracks from playlist")
-        
-        tracks = []
-        for track in playlist['tracks']:
+async def unfollow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /unfollow command - Stop following one of the user's playlists"""
+    chat_id = update.effective_chat.id
+    if not context.args:
+        await update.message.reply_text(
+            "Send the playlist to stop following along with the command, e.g.\n"
+            "<code>/unfollow PLXd3ds-SIEMJfFfhlv2hpMwbzFwB3ambu</code>\n\n"
+            "Use /list to see the playlists you follow.",
+            parse_mode='HTML'
+        )
+        return
+    
+    playlist_id = extract_playlist_id(context.args[0])
+    if playlist_id == YOUTUBE_PLAYLIST_ID:
+        await update.message.reply_text(
+            "ℹ️ Every subscriber follows the default playlist. Use /stop to unsubscribe from everything.",
+            parse_mode='HTML'
+        )
+    elif follow_index.unfollow(chat_id, playlist_id):
+        await update.message.reply_text(
+            f"👋 You no longer follow <code>{html.escape(playlist_id)}</code>.",
+            parse_mode='HTML'
+        )
+        log.info(f"Chat {chat_id} unfollowed {playlist_id}")
+    else:
+        await reply_not_following(update)
+
+async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /list command - List the playlists the user follows"""
+    chat_id = update.effective_chat.id
+    lines = ["📋 <b>Your Playlists</b>\n"]
+    for playlist_id in get_chat_playlists(chat_id):
+        # Only saved state is shown; /status fetches what's missing
+        track_count = state_store.get_snapshot_size(playlist_id)
+        songs = f"{track_count} songs" if track_count is not None else "not checked yet"
+        default = " (default)" if playlist_id == YOUTUBE_PLAYLIST_ID else ""
+        lines.append(f"• <code>{playlist_id}</code>{default}: {songs}")
+    lines.append("\nUse /setplaylist to follow another playlist and /unfollow to drop one.")
+    
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+# Returned instead of tracks when a playlist matches the known fingerprint
+PLAYLIST_UNCHANGED = object()
+# Returned instead of a preview when YouTube Music, not the playlist, is the problem
+UPSTREAM_DOWN = object()
+
+def parse_track(track):
+    """Reduce a raw ytmusicapi track to the fields the bot keeps"""
+    # Get the best quality SQUARE thumbnail (not wide)
+    thumbnail = None
+    if track.get('thumbnails'):
+        # YouTube Music thumbnails - get the largest square one
+        for thumb in reversed(track['thumbnails']):
+            if thumb.get('width') == thumb.get('height'):  # Square thumbnail
+                thumbnail = thumb['url']
+                break
+        # Fallback to any thumbnail if no square found
+        if not thumbnail and track['thumbnails']:
+            thumbnail = track['thumbnails'][-1]['url']
+    
+    return Track(
+        track.get('videoId'),
+        track.get('title', 'Unknown'),
+        ', '.join([artist['name'] for artist in track.get('artists', [])]) if track.get('artists') else 'Unknown Artist',
+        thumbnail
+    )
+
+def get_playlist_tracks(playlist_id=None, known_fingerprint=None):
+    """Fetch current tracks from YouTube Music playlist
+
+    Pages are handled as they arrive, so only one raw page is held at a time
+    however long the playlist is. The raw videoIds are fingerprinted on the
+    way; songs already in the saved snapshot reuse its Track and only new
+    ones go through parse_track, so an unchanged playlist parses nothing.
+    If the fingerprint matches known_fingerprint, PLAYLIST_UNCHANGED is
+    returned. Errors are raised for the upstream guard to retry or count;
+    pages that stop before the end of the playlist raise
+    IncompleteResponseError, which only counts against this playlist.
+    """
+    if playlist_id is None:
+        playlist_id = YOUTUBE_PLAYLIST_ID
+    
+    log.debug(f"🔍 Fetching playlist: {playlist_id}")
+    
+    # ytmusicapi is only imported once something is fetched
+    from playlist_pages import PlaylistPages
+    pages = PlaylistPages(get_ytmusic(), playlist_id)
+    # Titles and artwork of a song already tracked are kept as saved
+    known_tracks = saved_snapshots.get(playlist_id) or []
+    known_by_id = None
+    fingerprint = Fingerprint()
+    tracks = []
+    parsed = 0
+    for page in pages:
+        for raw_track in page:
             # Skip None tracks
-            if not track:
+            if not raw_track:
                 continue
-            
-            # Get the best quality SQUARE thumbnail (not wide)
-            thumbnail = None
-            if track.get('thumbnails'):
-                # YouTube Music thumbnails - get the largest square one
-                for thumb in reversed(track['thumbnails']):
-                    if thumb.get('width') == thumb.get('height'):  # Square thumbnail
-                        thumbnail = thumb['url']
-                        break
-                # Fallback to any thumbnail if no square found
-                if not thumbnail and track['thumbnails']:
-                    thumbnail = track['thumbnails'][-1]['url']
-            
-            tracks.append({
-                'videoId': track.get('videoId'),
-                'title': track.get('title', 'Unknown'),
-                'artists': ', '.join([artist['name'] for artist in track.get('artists', [])]) if track.get('artists') else 'Unknown Artist',
-                'thumbnail': thumbnail
-            })
-        
-        print(f"✅ Successfully fetched {len(tracks)} tracks")
-        
-        # Check if we might be missing tracks
-        if len(tracks) % 100 == 0 and len(tracks) >= 100:
-            print(f"⚠️ Got exactly {len(tracks)} tracks - this might indicate pagination limit")
-        
-        return tracks
-        
+            video_id = raw_track.get('videoId')
+            fingerprint.add(video_id)
+            position = len(tracks)
+            if position < len(known_tracks) and known_tracks[position].videoId == video_id:
+                # Same song in the same place, the common case
+                tracks.append(known_tracks[position])
+                continue
+            if known_by_id is None:
+                known_by_id = {track.videoId: track for track in known_tracks if track.videoId}
+            track = known_by_id.get(video_id) if video_id else None
+            if track is None:
+                track = parse_track(raw_track)
+                parsed += 1
+            tracks.append(track)
+    tracks_parsed.inc(parsed)
+    
+    if not pages.complete:
+        # Treating a cut-off list as current would report every missing song as removed
+        raise IncompleteResponseError(
+            f"pagination stopped after {pages.fetched} tracks ({pages.pages} pages)"
+        )
+    if pages.truncated:
+        log.warning(f"⚠️ Playlist {playlist_id} lists {pages.track_count} songs but only "
+                    f"{pages.fetched} came back (hidden or unavailable tracks?)")
+    
+    # Check if tracks is empty
+    if not tracks:
+        log.warning("⚠️ Playlist has no tracks")
+        return []
+    
+    # ytmusicapi exposes no version marker, so hash the ordered videoIds
+    if known_fingerprint and fingerprint.hexdigest() == known_fingerprint:
+        log.debug(f"⏭️ Playlist {playlist_id} unchanged")
+        return PLAYLIST_UNCHANGED
+    
+    log.info(f"✅ Successfully fetched {len(tracks)} tracks in {pages.pages} pages")
+    return tracks
+
+def get_playlist_preview(playlist_id):
+    """Header song count and first page of tracks of a playlist, without fetching the rest"""
+    from playlist_pages import PlaylistPages
+    pages = PlaylistPages(get_ytmusic(), playlist_id, max_pages=1)
+    tracks = [parse_track(track) for page in pages for track in page if track]
+    tracks_parsed.inc(len(tracks))
+    return pages.track_count, tracks
+
+def get_stale_tracks(playlist_id, known_fingerprint=None):
+    """Last known tracks of a playlist from the cache or the state store, or None"""
+    tracks = snapshot_cache.get(playlist_id, max_age=float('inf'))
+    if tracks is None and state_store.has_snapshot(playlist_id):
+        tracks = load_previous_state(playlist_id)
+    if tracks is not None and known_fingerprint and playlist_fingerprint(tracks) == known_fingerprint:
+        return PLAYLIST_UNCHANGED
+    return tracks
+
+async def fetch_playlist_tracks(playlist_id=None, force_refresh=False, known_fingerprint=None, allow_stale=True):
+    """Fetch playlist tracks on the fetch engine without blocking the event loop
+
+    Recently fetched playlists are served from the snapshot cache unless
+    force_refresh is set. With known_fingerprint, PLAYLIST_UNCHANGED is
+    returned when the playlist still matches it. While the circuit breaker
+    is open the last known tracks are returned instead if allow_stale is
+    set, None otherwise. Returns None if the fetch failed.
+    """
+    if playlist_id is None:
+        playlist_id = YOUTUBE_PLAYLIST_ID
+    
+    if not force_refresh:
+        cached_tracks = snapshot_cache.get(playlist_id)
+        if cached_tracks is not None:
+            if known_fingerprint and playlist_fingerprint(cached_tracks) == known_fingerprint:
+                return PLAYLIST_UNCHANGED
+            return cached_tracks
+    
+    started = time.perf_counter()
+    try:
+        with span('fetch', playlist_id=playlist_id) as fetch_span:
+            # Chats checking the same playlist at the same time share one request
+            tracks = await ytmusic_upstream.call(
+                playlist_id, fetch_engine.run_shared,
+                ('playlist', playlist_id, known_fingerprint), 'ytmusic',
+                get_playlist_tracks, playlist_id, known_fingerprint
+            )
+            fetch_span.set(tracks='unchanged' if tracks is PLAYLIST_UNCHANGED else len(tracks))
+    except UpstreamUnavailable:
+        fetch_errors.inc(cause='unavailable')
+        if not allow_stale:
+            return None
+        log.warning(f"⛔ YouTube Music unavailable - serving last known state of {playlist_id}")
+        return get_stale_tracks(playlist_id, known_fingerprint)
     except Exception as e:
-        print(f"❌ Error fetching playlist {playlist_id}: {type(e).__name__}: {e}")
-        traceback.print_exc()
+        if is_transient(e):
+            fetch_errors.inc(cause='transient')
+            log.error(f"❌ Error fetching playlist {playlist_id}: {type(e).__name__}: {e}")
+        elif isinstance(e, IncompleteResponseError):
+            fetch_errors.inc(cause='incomplete')
+            log.error(f"❌ Incomplete playlist {playlist_id}: {e}")
+        else:
+            fetch_errors.inc(cause='request')
+            log.exception(f"❌ Error fetching playlist {playlist_id}: {type(e).__name__}: {e}")
         return None
+    
+    elapsed = time.perf_counter() - started
+    fetch_seconds.observe(elapsed)
+    playlist_fetch_seconds.set(elapsed, playlist_id=playlist_id)
+    if tracks is not PLAYLIST_UNCHANGED:
+        snapshot_cache.put(playlist_id, tracks)
+    return tracks
+
+async def fetch_playlist_preview(playlist_id):
+    """Check that a playlist exists and is readable from its first page
 
-def load_previous_state():
-    """Load previous playlist state from file"""
+    Returns (track_count, tracks), where track_count is the count in the
+    playlist header (None if it couldn't be read) and tracks the first page.
+    Returns UPSTREAM_DOWN while the circuit breaker is open or YouTube Music
+    keeps failing, and None if the playlist itself couldn't be fetched.
+    """
     try:
-        if os.path.exists(PLAYLIST_FILE):
-            with open(PLAYLIST_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data
-        return []
+        with span('fetch_preview', playlist_id=playlist_id) as fetch_span:
+            track_count, tracks = await ytmusic_upstream.call(
+                playlist_id, fetch_engine.run, 'ytmusic', get_playlist_preview, playlist_id
+            )
+            fetch_span.set(tracks=len(tracks), track_count=track_count)
+    except UpstreamUnavailable:
+        fetch_errors.inc(cause='unavailable')
+        log.warning(f"⛔ YouTube Music unavailable - can't validate {playlist_id}")
+        return UPSTREAM_DOWN
     except Exception as e:
-        print(f"Error loading previous state: {e}")
+        transient = is_transient(e)
+        fetch_errors.inc(cause='transient' if transient else 'request')
+        log.error(f"❌ Error validating playlist {playlist_id}: {type(e).__name__}: {e}")
+        return UPSTREAM_DOWN if transient else None
+    return track_count, tracks
+
+# Baselines being built for newly followed playlists, by playlist ID
+baseline_tasks = {}
+
+def build_baseline_later(playlist_id):
+    """Fetch a newly followed playlist in full and save it as its first snapshot, in the background"""
+    if playlist_id not in baseline_tasks:
+        baseline_tasks[playlist_id] = asyncio.create_task(build_baseline(playlist_id))
+        baseline_tasks[playlist_id].add_done_callback(lambda _: baseline_tasks.pop(playlist_id, None))
+
+async def build_baseline(playlist_id):
+    started = time.perf_counter()
+    tracks = await fetch_playlist_tracks(playlist_id, force_refresh=True, allow_stale=False)
+    if tracks is None:
+        # The first polling check of the playlist saves it instead
+        log.warning(f"⚠️ Couldn't build the baseline of {playlist_id} - leaving it to the next check")
+        return
+    # A check (/check or polling) may have saved it first
+    if not state_store.has_snapshot(playlist_id):
+        await fetch_engine.run('state', save_current_state, tracks, playlist_id)
+        log.info(f"📸 Baseline of {playlist_id} saved in the background: {len(tracks)} songs "
+                 f"in {time.perf_counter() - started:.1f}s")
+
+def load_previous_state(playlist_id=None):
+    """Load previous playlist state, from memory if it still matches the state store"""
+    playlist_id = playlist_id or YOUTUBE_PLAYLIST_ID
+    try:
+        tracks = saved_snapshots.get(playlist_id)
+        # Another process (a polling worker, /check) may have saved a newer state
+        if tracks is not None and playlist_fingerprint(tracks) == state_store.get_snapshot_fingerprint(playlist_id):
+            return tracks
+        tracks = state_store.load_snapshot(playlist_id)
+        saved_snapshots.put(playlist_id, tracks)
+        return tracks
+    except Exception as e:
+        log.error(f"Error loading previous state: {e}")
         return []
 
-def save_current_state(tracks):
-    """Save current playlist state to file"""
+def save_current_state(tracks, playlist_id=None):
+    """Save current playlist state to the state store"""
+    playlist_id = playlist_id or YOUTUBE_PLAYLIST_ID
     try:
         # Save full track data so we have it when songs are removed
-        with open(PLAYLIST_FILE, 'w', encoding='utf-8') as f:
-            json.dump(tracks, f, ensure_ascii=False, indent=2)
+        state_store.save_snapshot(playlist_id, tracks)
+        saved_snapshots.put(playlist_id, tracks)
+    except Exception as e:
+        log.error(f"Error saving state: {e}")
+
+async def preload_snapshots():
+    """Load the saved state of every followed playlist into memory after a restart
+
+    Runs on the fetch engine in the background, so the first /status and the
+    first check of each playlist don't wait on the database.
+    """
+    started = time.perf_counter()
+    try:
+        playlist_ids = [playlist_id for playlist_id in get_playlist_groups() if playlist_id]
+        loaded = 0
+        for playlist_id in playlist_ids:
+            if state_store.has_snapshot(playlist_id):
+                await fetch_engine.run('state', load_previous_state, playlist_id)
+                loaded += 1
+        log.info(f"🔥 Preloaded {loaded} playlist snapshots in {time.perf_counter() - started:.2f}s")
     except Exception as e:
-        print(f"Error saving state: {e}")
-
-def compare_playlists(old_tracks, new_tracks):
-    """Compare two playlist states and return added/removed songs"""
-    # Create sets of video IDs only
-    old_ids = {track['videoId'] for track in old_tracks if track.get('videoId')}
-    new_ids = {track['videoId'] for track in new_tracks if track.get('videoId')}
-    
-    added_ids = new_ids - old_ids
-    removed_ids = old_ids - new_ids
-    
-    # Get full track info for added songs (from new_tracks which has all data)
-    added_songs = [track for track in new_tracks if track['videoId'] in added_ids]
-    
-    # For removed songs, get data from old_tracks, but add placeholders if missing
-    removed_songs = []
-    for track in old_tracks:
-        if track['videoId'] in removed_ids:
-            # Ensure all required fields exist
-            removed_song = {
-                'videoId': track.get('videoId'),
-                'title': track.get('title', 'Unknown Title'),
-                'artists': track.get('artists', 'Unknown Artist'),
-                'thumbnail': track.get('thumbnail', None)
-            }
-            removed_songs.append(removed_song)
-    
-    print(f"Comparison: {len(old_ids)} old tracks, {len(new_ids)} new tracks")
-    print(f"Found: {len(added_songs)} added, {len(removed_songs)} removed")
-    
-    return added_songs, removed_songs
-
-def format_song_caption(song, action):
-    """Format song caption for photo message"""
+        log.error(f"Error preloading snapshots: {e}")
+
+def save_playlist_changes(playlist_id, diff, fingerprint, chat_ids=(), trace_id=None, base_fingerprint=None):
+    """Append the edits found by diff_playlists to the saved state
+
+    Notifications for chat_ids are queued in the outbox in the same
+    transaction. That is a row per chat and change, so this runs on the
+    fetch engine rather than the event loop. base_fingerprint is that of
+    the state the diff was made against; if another process (a polling
+    worker, /check) saved over it first, its notifications already went
+    out and nothing is saved. Returns False if nothing could be saved.
+    """
+    try:
+        notifications = build_notifications(diff, chat_ids, fingerprint, trace_id, playlist_id)
+        saved = state_store.record_changes(playlist_id, diff.events, fingerprint, notifications, base_fingerprint)
+        if not saved:
+            log.info(f"⏭️ {playlist_id} was saved by another check first, dropping this diff")
+        return saved
+    except Exception as e:
+        log.error(f"Error saving state changes: {e}")
+        return False
+
+def format_reorder_summary(diff, playlist_id=None):
+    """Summarize reordered songs and duplicate changes, or None if there are none"""
+    if not (diff.moved or diff.duplicates):
+        return None
+    
+    lines = []
+    if playlist_id:
+        lines.append(playlist_line(playlist_id))
+    if diff.moved:
+        lines.append(f"🔀 <b>{len(diff.moved)} song{'s' if len(diff.moved) != 1 else ''} moved</b> in the playlist")
+    for video_id, old_count, new_count, track in diff.duplicates[:10]:
+        title = html.escape(track.title or 'Unknown Title')
+        lines.append(f"🔁 <b>{title}</b> now appears {new_count}× (was {old_count}×)")
+    if len(diff.duplicates) > 10:
+        lines.append(f"…and {len(diff.duplicates) - 10} more duplicate changes")
+    return "\n".join(lines)
+
+def format_song_caption(song, action, playlist_id=None):
+    """Format song caption for photo message, naming the playlist it changed in"""
     if action == "added":
         emoji = "➕"
         title = "Song Added!"
@@ -519,231 +876,648 @@ def format_song_caption(song, action):
         title = "Song Removed!"
     
     # Safely get song data with defaults
-    song_title = song.get('title', 'Unknown Title')
-    song_artists = song.get('artists', 'Unknown Artist')
-    song_video_id = song.get('videoId', '')
+    song_title = html.escape(song.title or 'Unknown Title')
+    song_artists = html.escape(song.artists or 'Unknown Artist')
+    song_video_id = html.escape(song.videoId or '')
     
     caption = (
         f"<b>{emoji} {title}</b>\n\n"
         f"🎵 <b>{song_title}</b>\n"
         f"👤 Artist: {song_artists}\n"
-        f"💿 Album: YouTube Music\n\n"
+        f"💿 Album: YouTube Music\n"
+        f"{playlist_line(playlist_id)}\n"
         f"🔗 <a href='https://music.youtube.com/watch?v={song_video_id}'>Listen on YouTube Music</a>"
     )
     
     return caption
 
-def download_image(url):
-    """Download image from URL and return as BytesIO"""
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            return BytesIO(response.content)
-        return None
-    except Exception as e:
-        print(f"Error downloading image: {e}")
-        return None
+async def send_song_card_to_subscribers(bot, song, action, chat_ids=None, on_sent=None, playlist_id=None):
+    """Send song card with thumbnail to the given chats (all subscribers by default)
 
-async def send_song_card_to_subscribers(bot, song, action):
-    """Send song card with thumbnail to all subscribers"""
-    subscribers = load_subscribers()
-    caption = format_song_caption(song, action)
+    A thumbnail is uploaded once; every other chat gets it by the file_id
+    Telegram returned, which is remembered across restarts. on_sent(chat_id,
+    changes) is called after each successful delivery.
+    """
+    recipients = list(load_subscribers() if chat_ids is None else chat_ids)
+    caption = format_song_caption(song, action, playlist_id)
+    thumbnail_url = song.thumbnail
     
-    # Download image once if thumbnail exists
-    image_data = None
-    if song.get('thumbnail'):
-        image_data = download_image(song['thumbnail'])
+    photo = state_store.get_thumbnail_file_id(thumbnail_url) if thumbnail_url else None
+    image_bytes = None
+    if thumbnail_url and photo is None:
+        # Download image once if thumbnail exists
+        image_bytes = await image_fetcher.fetch(thumbnail_url)
     
-    for chat_id in subscribers:
-        try:
-            if image_data:
-                # Reset buffer position for each send
-                image_data.seek(0)
+    async def upload_card(chat_id):
+        nonlocal photo
+        message = await bot.send_photo(
+            chat_id=chat_id,
+            photo=image_bytes,
+            caption=caption,
+            parse_mode='HTML'
+        )
+        if message and message.photo:
+            photo = message.photo[-1].file_id
+            await fetch_engine.run('state', state_store.set_thumbnail_file_id, thumbnail_url, photo)
+        if on_sent:
+            on_sent(chat_id, [(song, action)])
+    
+    async def send_card(chat_id):
+        nonlocal photo, image_bytes
+        if photo or image_bytes:
+            sent_photo = photo or image_bytes
+            try:
                 # Send photo (not document) - Telegram will display it inline
                 await bot.send_photo(
                     chat_id=chat_id,
-                    photo=image_data,
+                    photo=sent_photo,
                     caption=caption,
                     parse_mode='HTML'
                 )
-            else:
-                # Fallback to text message if no thumbnail
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text=caption,
-                    parse_mode='HTML',
-                    disable_web_page_preview=True
-                )
-        except Exception as e:
-            print(f"Failed to send to {chat_id}: {e}")
+            except BadRequest as e:
+                if not (isinstance(sent_photo, str) and is_stale_file_id(e)):
+                    raise
+                # The file_id went stale (or belongs to another bot token):
+                # forget it and upload the image again
+                log.warning(f"🖼️ Cached file_id for {thumbnail_url} was rejected - uploading again")
+                if photo == sent_photo:
+                    photo = None
+                    await fetch_engine.run('state', state_store.delete_thumbnail_file_id, thumbnail_url)
+                image_bytes = image_bytes or await image_fetcher.fetch(thumbnail_url)
+                if not image_bytes:
+                    raise
+                await upload_card(chat_id)
+                return
+        else:
+            # Fallback to text message if no thumbnail
+            await bot.send_message(
+                chat_id=chat_id,
+                text=caption,
+                parse_mode='HTML',
+                disable_web_page_preview=True
+            )
+        if on_sent:
+            on_sent(chat_id, [(song, action)])
+    
+    delivered = 0
+    # Upload to the first chat that accepts it, then reuse the file_id
+    attempts = 0
+    while image_bytes and photo is None and recipients and attempts < 3:
+        attempts += 1
+        delivered += await dispatcher.send(recipients.pop(0), upload_card)
+    
+    return delivered + await dispatcher.fan_out(recipients, send_card)
+
+async def send_album_to_subscribers(bot, changes, chat_ids, on_sent=None, playlist_id=None):
+    """Send up to 10 (song, action) changes to the given chats as one media group
 
-async def check_playlist_for_user(chat_id, bot):
-    """Check playlist and send update to specific user"""
-    user_playlist_id = get_user_playlist_id(chat_id)
-    current_tracks = get_playlist_tracks(user_playlist_id)
+    Like single cards, each photo is uploaded once and then sent by file_id.
+    Songs whose artwork can't be fetched fall back to single cards.
+    """
+    recipients = list(chat_ids)
+    photos = []
+    for song, _ in changes:
+        photos.append(state_store.get_thumbnail_file_id(song.thumbnail))
+    missing = [index for index, photo in enumerate(photos) if photo is None]
+    downloads = await asyncio.gather(*(image_fetcher.fetch(changes[index][0].thumbnail) for index in missing))
+    for index, image_bytes in zip(missing, downloads):
+        photos[index] = image_bytes
     
-    # Use user-specific state file
-    user_state_file = f'playlist_state_{chat_id}.json'
+    delivered = 0
+    album = [(change, photo) for change, photo in zip(changes, photos) if photo]
+    for (song, action), photo in zip(changes, photos):
+        if not photo:
+            await send_song_card_to_subscribers(bot, song, action, recipients, on_sent, playlist_id)
+    if len(album) < 2:
+        for (song, action), _ in album:
+            delivered += await send_song_card_to_subscribers(bot, song, action, recipients, on_sent, playlist_id)
+        return delivered
     
-    try:
-        if os.path.exists(user_state_file):
-            with open(user_state_file, 'r', encoding='utf-8') as f:
-                previous_tracks = json.load(f)
-        else:
-            previous_tracks = []
-    except Exception as e:
-        print(f"Error loading user state: {e}")
-        previous_tracks = []
+    album_changes = [change for change, _ in album]
     
-    if not current_tracks:
-        await bot.send_message(chat_id=chat_id, text="❌ Failed to fetch playlist", parse_mode='HTML')
-        return
+    def build_media():
+        return [
+            InputMediaPhoto(media=photo, caption=format_song_caption(song, action, playlist_id), parse_mode='HTML')
+            for (song, action), photo in album
+        ]
     
-    if not previous_tracks:
+    async def upload_album(chat_id):
+        nonlocal album
+        messages = await bot.send_media_group(chat_id=chat_id, media=build_media())
+        uploaded = []
+        for ((song, action), photo), message in zip(album, messages):
+            if isinstance(photo, bytes) and message.photo:
+                photo = message.photo[-1].file_id
+                await fetch_engine.run('state', state_store.set_thumbnail_file_id, song.thumbnail, photo)
+            uploaded.append(((song, action), photo))
+        album = uploaded
+        if on_sent:
+            on_sent(chat_id, album_changes)
+    
+    async def send_album(chat_id):
+        nonlocal album
+        sent_album = album
         try:
-            with open(user_state_file, 'w', encoding='utf-8') as f:
-                json.dump(current_tracks, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Error saving user state: {e}")
-            
-        await bot.send_message(
-            chat_id=chat_id,
-            text=f"✅ Playlist loaded! Currently tracking {len(current_tracks)} songs.",
-            parse_mode='HTML'
-        )
-        return
+            await bot.send_media_group(chat_id=chat_id, media=build_media())
+        except BadRequest as e:
+            if not (any(isinstance(photo, str) for _, photo in sent_album) and is_stale_file_id(e)):
+                raise
+            # Telegram doesn't say which file_id went stale, so upload every cached one again
+            log.warning("🖼️ Cached file_ids of an album were rejected - uploading again")
+            if album is sent_album:
+                refreshed = []
+                for (song, action), photo in album:
+                    if isinstance(photo, str):
+                        await fetch_engine.run('state', state_store.delete_thumbnail_file_id, song.thumbnail)
+                        photo = await image_fetcher.fetch(song.thumbnail)
+                        if not photo:
+                            raise
+                    refreshed.append(((song, action), photo))
+                album = refreshed
+            await upload_album(chat_id)
+            return
+        if on_sent:
+            on_sent(chat_id, album_changes)
     
-    added_songs, removed_songs = compare_playlists(previous_tracks, current_tracks)
-    
-    if added_songs or removed_songs:
-        # Send individual card for each added song
-        if added_songs:
-            for song in added_songs:
-                caption = format_song_caption(song, "added")
-                if song.get('thumbnail'):
-                    image_data = download_image(song['thumbnail'])
-                    if image_data:
-                        await bot.send_photo(
-                            chat_id=chat_id,
-                            photo=image_data,
-                            caption=caption,
-                            parse_mode='HTML'
-                        )
-                    else:
-                        await bot.send_message(
-                            chat_id=chat_id,
-                            text=caption,
-                            parse_mode='HTML',
-                            disable_web_page_preview=True
-                        )
-                else:
-                    await bot.send_message(
-                        chat_id=chat_id,
-                        text=caption,
-                        parse_mode='HTML',
-                        disable_web_page_preview=True
-                    )
-                await asyncio.sleep(0.5)
-        
-        # Send individual card for each removed song
-        if removed_songs:
-            for song in removed_songs:
-                caption = format_song_caption(song, "removed")
-                if song.get('thumbnail'):
-                    image_data = download_image(song['thumbnail'])
-                    if image_data:
-                        await bot.send_photo(
-                            chat_id=chat_id,
-                            photo=image_data,
-                            caption=caption,
-                            parse_mode='HTML'
-                        )
-                    else:
-                        await bot.send_message(
-                            chat_id=chat_id,
-                            text=caption,
-                            parse_mode='HTML',
-                            disable_web_page_preview=True
-                        )
-                else:
-                    await bot.send_message(
-                        chat_id=chat_id,
-                        text=caption,
-                        parse_mode='HTML',
-                        disable_web_page_preview=True
+    # Upload to the first chat that accepts it, then reuse the file_ids
+    attempts = 0
+    while any(isinstance(photo, bytes) for _, photo in album) and recipients and attempts < 3:
+        attempts += 1
+        delivered += await dispatcher.send(recipients.pop(0), upload_album, cost=len(album))
+    
+    return delivered + await dispatcher.fan_out(recipients, send_album, cost=len(album))
+
+async def send_change_batches(bot, added_songs, removed_songs, chat_ids, on_sent=None, playlist_id=None):
+    """Send added/removed songs of one playlist as cards, albums or a digest"""
+    for kind, changes in plan_notifications(added_songs, removed_songs):
+        if kind == 'digest':
+            pages = format_digest_pages(changes, playlist_id)
+            for page_number, page in enumerate(pages, 1):
+                # The digest counts as delivered once its last page is
+                page_sent = None
+                if on_sent and page_number == len(pages):
+                    page_sent = lambda chat_id, changes=changes: on_sent(chat_id, changes)
+                await send_text_to_chats(bot, chat_ids, page, on_sent=page_sent, disable_web_page_preview=True)
+        elif kind == 'album':
+            await send_album_to_subscribers(bot, changes, chat_ids, on_sent, playlist_id)
+        else:
+            song, action = changes[0]
+            await send_song_card_to_subscribers(bot, song, action, chat_ids, on_sent, playlist_id)
+
+async def send_text_to_chats(bot, chat_ids, text, on_sent=None, **kwargs):
+    """Send the same text message to several chats"""
+    async def send_text(chat_id):
+        await bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML', **kwargs)
+        if on_sent:
+            on_sent(chat_id)
+    
+    return await dispatcher.fan_out(chat_ids, send_text)
+
+def build_notifications(diff, chat_ids, fingerprint, trace_id=None, playlist_id=None):
+    """Outbox rows (chat_id, video_id, action, payload) for every recipient of a diff
+
+    trace_id ties each delivery back to the check that found the change.
+    """
+    changes = [(song, 'added') for song in diff.added] + [(song, 'removed') for song in diff.removed]
+    summary = format_reorder_summary(diff, playlist_id)
+    notifications = []
+    for chat_id in chat_ids:
+        for song, action in changes:
+            notifications.append((chat_id, song.videoId, action, dict(song.to_dict(), trace_id=trace_id)))
+        if summary:
+            notifications.append((chat_id, f'summary:{fingerprint}', 'summary', {'text': summary, 'trace_id': trace_id}))
+    return notifications
+
+async def send_pending_notifications(bot, items, chat_ids):
+    """Send one set of queued (playlist_id, video_id, action, payload) items to chats that all have it queued
+
+    Each playlist's changes are batched on their own, so every
+    acknowledgement names the playlist it was queued for. Acknowledgements
+    are written on the fetch engine while sending goes on. Returns the
+    number of items acknowledged.
+    """
+    acked = {chat_id: set() for chat_id in chat_ids}
+    ack_writes = []
+    
+    def ack(chat_id, keys):
+        acked[chat_id].update(keys)
+        ack_writes.append(asyncio.ensure_future(
+            fetch_engine.run('state', state_store.ack_notifications, chat_id, keys)
+        ))
+    
+    by_playlist = {}
+    for playlist_id, video_id, action, payload in items:
+        by_playlist.setdefault(playlist_id, []).append((video_id, action, payload))
+    
+    # The checks that queued these items, to find them in the logs
+    traces = sorted({payload['trace_id'] for *_, payload in items if payload.get('trace_id')})
+    with span('outbox_delivery', logging.INFO, chats=len(chat_ids), items=len(items),
+              traces=','.join(traces) or '-') as delivery_span:
+        for playlist_id, playlist_items in by_playlist.items():
+            def on_changes_sent(chat_id, changes, playlist_id=playlist_id):
+                ack(chat_id, [(playlist_id, song.videoId, action) for song, action in changes])
+            
+            added_songs = [Track.from_dict(payload) for _, action, payload in playlist_items if action == 'added']
+            removed_songs = [Track.from_dict(payload) for _, action, payload in playlist_items if action == 'removed']
+            await send_change_batches(bot, added_songs, removed_songs, chat_ids, on_changes_sent, playlist_id)
+            
+            for video_id, action, payload in playlist_items:
+                if action == 'summary':
+                    await send_text_to_chats(
+                        bot, chat_ids, payload['text'],
+                        on_sent=lambda chat_id, key=(playlist_id, video_id, action): ack(chat_id, [key])
                     )
-                await asyncio.sleep(0.5)
-        
-        # Update state after sending notifications
+        delivery_span.set(acked=sum(len(chat_keys) for chat_keys in acked.values()))
+    
+    for result in await asyncio.gather(*ack_writes, return_exceptions=True):
+        if isinstance(result, Exception):
+            # Those rows stay queued and are sent again
+            log.error(f"Error acknowledging notifications: {result}")
+    
+    # Count a failed attempt for whatever a chat didn't get
+    keys = {(playlist_id, video_id, action) for playlist_id, video_id, action, _ in items}
+    for chat_id in chat_ids:
+        missed = keys - acked[chat_id]
+        if missed:
+            dropped = await fetch_engine.run(
+                'state', state_store.fail_notifications, chat_id, missed, OUTBOX_MAX_ATTEMPTS
+            )
+            if dropped:
+                log.warning(f"🗑️ Gave up on {dropped} notifications after {OUTBOX_MAX_ATTEMPTS} attempts")
+    return sum(len(chat_keys) for chat_keys in acked.values())
+
+async def deliver_outbox(bot):
+    """Deliver everything waiting in the outbox
+
+    Each round takes the oldest OUTBOX_BATCH_SIZE distinct changes with every
+    chat they are queued for, so one diff reaches all its recipients in the
+    same concurrent fan-out. Chats with the same pending changes are sent
+    them together, so albums and file_ids are still shared between them.
+    Each chat's rows are deleted as soon as Telegram accepts its message; a
+    crash in between means that one message is sent again after the
+    restart, never that it is lost.
+    """
+    async with outbox_lock:
+        while True:
+            pending_items = state_store.get_pending_items(limit=OUTBOX_BATCH_SIZE)
+            if not pending_items:
+                return
+            
+            by_chat = {}
+            for item in pending_items:
+                for chat_id in state_store.get_item_chats(*item[:3]):
+                    by_chat.setdefault(chat_id, []).append(item)
+            pending = sum(len(items) for items in by_chat.values())
+            groups = {}
+            for chat_id, items in by_chat.items():
+                key = tuple((playlist_id, video_id, action) for playlist_id, video_id, action, _ in items)
+                groups.setdefault(key, (items, []))[1].append(chat_id)
+            
+            delivered = 0
+            for items, chat_ids in groups.values():
+                delivered += await send_pending_notifications(bot, items, chat_ids)
+            log.info(f"📬 Outbox: {delivered}/{pending} delivered, {state_store.outbox_depth()} still queued")
+            if not delivered:
+                # Everything failed this round - retry on the next wake-up
+                return
+
+async def outbox_worker(bot):
+    """Background task that delivers the outbox whenever something is queued"""
+    while True:
+        await outbox_ready.wait()
+        outbox_ready.clear()
         try:
-            with open(user_state_file, 'w', encoding='utf-8') as f:
-                json.dump(current_tracks, f, ensure_ascii=False, indent=2)
+            await deliver_outbox(bot)
         except Exception as e:
-            print(f"Error saving user state: {e}")
-    else:
-        await bot.send_message(
-            chat_id=chat_id,
-            text="ℹ️ No changes detected in the playlist.",
-            parse_mode='HTML'
-        )
+            log.error(f"Error delivering outbox: {e}")
 
-async def check_playlist(bot):
-    """Main function to check playlist and send notifications to all subscribers"""
-    print("Checking playlist for changes...")
-    
-    current_tracks = get_playlist_tracks()
+def get_playlist_groups():
+    """Group subscribed chats by the playlist they follow
+
+    Every subscriber gets the default playlist; chats that follow more
+    playlists are also grouped under each of them. Each playlist shows up
+    once however many chats follow it.
+    """
+    return follow_index.groups()
+
+async def check_playlist_group(bot, playlist_id, chat_ids, force_refresh=False):
+    """Fetch and diff a playlist once, then queue notifications for every chat that follows it
+
+    Returns the PlaylistDiff, an empty one when a new baseline was saved, or
+    None if the playlist couldn't be fetched.
+    """
+    with span('playlist_check', logging.INFO, playlist_id=playlist_id, chats=len(chat_ids)) as check_span:
+        diff = await _check_playlist_group(bot, playlist_id, chat_ids, force_refresh)
+        check_span.set(outcome='failed' if diff is None else 'changed' if diff.changed else 'unchanged')
+        return diff
+
+async def _check_playlist_group(bot, playlist_id, chat_ids, force_refresh):
+    known_fingerprint = state_store.get_snapshot_fingerprint(playlist_id)
+    # Stale tracks would only hide changes from the diff
+    current_tracks = await fetch_playlist_tracks(
+        playlist_id, force_refresh=force_refresh, known_fingerprint=known_fingerprint, allow_stale=False
+    )
     if current_tracks is None:
-        print("Failed to fetch playlist")
-        return
+        log.error(f"Failed to fetch playlist {playlist_id}")
+        return None
     
-    previous_tracks = load_previous_state()
+    # Nothing changed since the saved snapshot - skip loading and diffing it
+    if current_tracks is PLAYLIST_UNCHANGED:
+        return EMPTY_DIFF
+    
+    previous_tracks = load_previous_state(playlist_id)
     
     if not previous_tracks:
         # First run - just save the state
-        save_current_state(current_tracks)
-        print(f"Initial state saved: {len(current_tracks)} songs")
-        return
+        await fetch_engine.run('state', save_current_state, current_tracks, playlist_id)
+        log.info(f"Initial state saved for {playlist_id}: {len(current_tracks)} songs")
+        return EMPTY_DIFF
     
-    added_songs, removed_songs = compare_playlists(previous_tracks, current_tracks)
+    with span('diff', playlist_id=playlist_id) as diff_span, diff_seconds.time():
+        diff = diff_playlists(previous_tracks, current_tracks)
+        diff_span.set(added=len(diff.added), removed=len(diff.removed), moved=len(diff.moved))
+    log.debug(f"Comparison: {len(previous_tracks)} old tracks, {len(current_tracks)} new tracks")
+    log.debug(f"Found: {len(diff.added)} added, {len(diff.removed)} removed, "
+              f"{len(diff.moved)} moved, {len(diff.duplicates)} duplicate changes")
     
-    # Send individual card for each added song
-    if added_songs:
-        for song in added_songs:
-            await send_song_card_to_subscribers(bot, song, "added")
-            await asyncio.sleep(0.5)
-        print(f"{len(added_songs)} songs added")
+    fingerprint = playlist_fingerprint(current_tracks)
+    if diff.changed:
+        log.info(f"{playlist_id}: {len(diff.added)} added, {len(diff.removed)} removed -> {len(chat_ids)} chats")
+        # The new state and its notifications are saved together, off the
+        # event loop, then the outbox worker delivers them. Saving only
+        # succeeds if nobody else saved over previous_tracks in the meantime.
+        saved = await fetch_engine.run(
+            'state', save_playlist_changes, playlist_id, diff, fingerprint, list(chat_ids), current_trace_id(),
+            playlist_fingerprint(previous_tracks)
+        )
+        if saved:
+            saved_snapshots.put(playlist_id, current_tracks)
+            outbox_ready.set()
+        else:
+            saved_snapshots.invalidate(playlist_id)
+    else:
+        log.info(f"No changes detected in {playlist_id}")
+        if fingerprint != known_fingerprint:
+            # Snapshots saved before fingerprints existed get one here
+            await fetch_engine.run('state', state_store.set_snapshot_fingerprint, playlist_id, fingerprint, known_fingerprint)
     
-    # Send individual card for each removed song
-    if removed_songs:
-        for song in removed_songs:
-            await send_song_card_to_subscribers(bot, song, "removed")
-            await asyncio.sleep(0.5)
-        print(f"{len(removed_songs)} songs removed")
+    return diff
+
+async def check_playlists_for_user(chat_id, bot):
+    """Check the user's playlists now and tell them the outcome
+
+    Changes are sent to every chat following a playlist, not only this
+    one, since they all share the same saved state.
+    """
+    if not ytmusic_upstream.available:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=f"⛔ YouTube Music isn't responding right now. "
+                 f"Checks resume automatically in about {ytmusic_upstream.breaker.retry_in:.0f}s.",
+            parse_mode='HTML'
+        )
+        return
     
-    if added_songs or removed_songs:
-        save_current_state(current_tracks)
-    else:
-        print("No changes detected")
+    playlist_ids = get_chat_playlists(chat_id)
+    for playlist_id in playlist_ids:
+        # Name the playlist when the chat follows several
+        prefix = f"<code>{playlist_id}</code>: " if len(playlist_ids) > 1 else ""
+        had_state = state_store.has_snapshot(playlist_id)
+        recipients = follow_index.recipients(playlist_id)
+        if chat_id not in recipients:
+            recipients.append(chat_id)
+        
+        # A manual check always goes to YouTube Music, never the cache
+        result = await check_playlist_group(bot, playlist_id, recipients, force_refresh=True)
+        poll_scheduler.record(playlist_id, None if result is None else result.changed)
+        
+        if result is None:
+            await bot.send_message(chat_id=chat_id, text=f"{prefix}❌ Failed to fetch playlist", parse_mode='HTML')
+        elif not had_state and not result.changed:
+            track_count = len(load_previous_state(playlist_id))
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"{prefix}✅ Playlist loaded! Currently tracking {track_count} songs.",
+                parse_mode='HTML'
+            )
+        elif not result.changed:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"{prefix}ℹ️ No changes detected in the playlist.",
+                parse_mode='HTML'
+            )
 
 async def periodic_check(application: Application):
-    """Periodic task to check playlist"""
+    """Periodic task that checks each followed playlist whenever its interval is up"""
+    await poll_forever(application.bot, get_playlist_groups)
+
+async def poll_forever(bot, get_groups, on_changed=None, on_success=record_poll_success, active=None):
+    """Check the playlists of get_groups() whenever their interval is up, forever
+
+    on_changed(playlist_id) is called for every playlist that changed and
+    on_success() after every round in which at least one playlist was
+    fetched, and while idle after such a round. While active() is
+    false nothing is polled. bot is None in worker processes, which only
+    queue notifications.
+    """
+    async def poll_group(playlist_id, chat_ids):
+        diff = await check_playlist_group(bot, playlist_id, chat_ids)
+        if diff is None and ytmusic_upstream.over_budget(playlist_id):
+            # A playlist that keeps failing backs off like an idle one
+            poll_scheduler.record(playlist_id, False)
+        else:
+            poll_scheduler.record(playlist_id, None if diff is None else diff.changed)
+        if on_changed and diff is not None and diff.changed:
+            on_changed(playlist_id)
+        # A playlist that couldn't be fetched fails the job
+        return diff is not None
+    
+    # Idle rounds report the health of the last round that polled anything
+    healthy = True
     while True:
+        if active and not active():
+            await asyncio.sleep(5)
+            continue
+        
+        if not ytmusic_upstream.available:
+            # Shed load until the circuit breaker lets a probe through
+            await asyncio.sleep(max(1, min(ytmusic_upstream.breaker.retry_in, poll_scheduler.min_interval)))
+            continue
+        
         try:
-            await check_playlist(application.bot)
+            groups = get_groups()
+            due = poll_scheduler.due(groups)
         except Exception as e:
-            print(f"Error in periodic check: {e}")
+            log.error(f"Error in periodic check: {e}")
+            await asyncio.sleep(poll_scheduler.min_interval)
+            continue
+        
+        if not due:
+            # Nothing to poll yet counts as a healthy round, unless the last one failed
+            if healthy:
+                on_success()
+            await asyncio.sleep(max(1, poll_scheduler.seconds_until_due()))
+            continue
+        
+        try:
+            with cycle_profiler.maybe_profile('cycle'), \
+                    span('poll_cycle', logging.INFO, playlists=len(due)) as cycle_span:
+                # Spread the due playlists over the shortest interval, the soonest
+                # any of them can be due again
+                cycle = await poll_scheduler.run_cycle(
+                    ((playlist_id, groups[playlist_id]) for playlist_id in due), poll_group,
+                    window=poll_scheduler.min_interval
+                )
+                cycle_span.set(failures=cycle['failures'])
+            poll_cycle_seconds.observe(cycle['duration'])
+            healthy = cycle['failures'] < cycle['jobs']
+            if healthy:
+                on_success()
+        except Exception as e:
+            healthy = False
+            log.error(f"Error in periodic check: {e}")
+        
+        if bot is not None:
+            # Retry anything an earlier delivery round couldn't send
+            if state_store.outbox_depth():
+                outbox_ready.set()
+            
+            send_stats = dispatcher.stats
+            log.info(f"📨 Notifications: {send_stats['sent']} sent, {send_stats['failed']} failed, "
+                     f"{send_stats['rate_limited']} rate limited, {send_stats['blocked']} unreachable chats dropped "
+                     f"(error rate {dispatcher.error_rate:.1%})")
+        
+        cache_stats = snapshot_cache.stats()
+        log.info(f"🗂️ Snapshot cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                 f"{cache_stats['entries']} playlists, {cache_stats['bytes'] // 1024} KiB")
         
-        await asyncio.sleep(CHECK_INTERVAL)
+        schedule_stats = poll_scheduler.stats()
+        log.info(f"🗓️ Schedule: {schedule_stats['playlists']} playlists, mean interval "
+                 f"{schedule_stats['mean_interval'] / 60:.1f} min, {schedule_stats['at_min']} at min, "
+                 f"{schedule_stats['at_max']} at max, {schedule_stats['deferred']} deferred by the request budget")
+        
+        await asyncio.sleep(max(1, poll_scheduler.seconds_until_due()))
+
+async def poll_shard(shard, shards, reports, stop):
+    """Poll one shard of the playlists in a worker process until stop is set
+
+    A lease makes sure no other process polls the same shard. Changes are
+    saved and queued in the outbox here; reports tell the bot process to
+    deliver them and that polling is still healthy.
+    """
+    lease = Lease(state_store, f'shard:{shard}/{shards}')
+    
+    def shard_groups():
+        # Follows change in the bot process, which this one doesn't see
+        follow_index.reload()
+        return {
+            playlist_id: chat_ids for playlist_id, chat_ids in get_playlist_groups().items()
+            if shard_of(playlist_id, shards) == shard
+        }
+    
+    tasks = [
+        asyncio.create_task(lease.keep()),
+        asyncio.create_task(poll_forever(
+            None, shard_groups,
+            on_changed=lambda playlist_id: reports.put(('changed', shard, playlist_id)),
+            on_success=lambda: reports.put(('polled', shard, None)),
+            active=lambda: lease.held
+        )),
+    ]
+    parent = multiprocessing.parent_process()
+    try:
+        # Also stop if the bot process died without telling us
+        while not stop.is_set() and (parent is None or parent.is_alive()):
+            await asyncio.sleep(1)
+    finally:
+        for task in tasks:
+            task.cancel()
+        lease.release()
+        fetch_engine.shutdown()
+        state_store.close()
+
+def handle_shard_report(kind, shard, playlist_id):
+    """Act on a report from a polling worker"""
+    if kind == 'changed':
+        # The worker queued the notifications; deliver them from here
+        outbox_ready.set()
+    elif kind == 'polled':
+        record_poll_success()
 
 async def startup_task(application: Application):
-    """Run periodic check in background"""
+    """Start snapshot preloading, periodic check and outbox delivery in the background"""
+    # Return right away so the bot starts taking updates while these warm up
+    asyncio.create_task(preload_snapshots())
+    asyncio.create_task(start_background_tasks(application))
+
+async def start_background_tasks(application: Application):
+    """Run periodic check and outbox delivery in background"""
     await asyncio.sleep(1)  # Wait 1 second for bot to fully start
-    asyncio.create_task(periodic_check(application))
+    asyncio.create_task(outbox_worker(application.bot))
+    asyncio.create_task(monitor_loop_lag())
+    # Resume notifications queued before a restart
+    if state_store.outbox_depth():
+        log.info(f"📬 Resuming {state_store.outbox_depth()} queued notifications")
+        outbox_ready.set()
+    shard_pool = application.bot_data.get('shard_pool')
+    if shard_pool:
+        # Worker processes poll; this process only talks to Telegram
+        asyncio.create_task(application.bot_data['telegram_lease'].keep())
+        shard_pool.start()
+        asyncio.create_task(shard_pool.reports_forever(handle_shard_report))
+    else:
+        asyncio.create_task(periodic_check(application))
 
-def main():
-    """Start the bot"""
-    # Create application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def shutdown_task(application: Application):
+    """Release background resources on shutdown"""
+    shard_pool = application.bot_data.get('shard_pool')
+    if shard_pool:
+        shard_pool.stop()
+        application.bot_data['telegram_lease'].release()
+    fetch_engine.shutdown()
+    await image_fetcher.close()
+    state_store.close()
+
+def register_metrics():
+    """Expose the counters other components keep in their stats on /metrics"""
+    metrics.callback(
+        'notifications_total', 'Notification sends by outcome',
+        lambda: {outcome: dispatcher.stats[outcome] for outcome in ('sent', 'failed', 'rate_limited', 'blocked')},
+        kind='counter', labelnames=('outcome',)
+    )
+    metrics.callback('notification_fanout_seconds_total', 'Time spent fanning out notifications',
+                     lambda: dispatcher.stats['fanout_seconds'], kind='counter')
+    metrics.callback('outbox_depth', 'Notifications waiting to be delivered', state_store.outbox_depth)
+    metrics.callback(
+        'cache_requests_total', 'Cache lookups by cache and result',
+        lambda: {
+            ('snapshot', 'hit'): snapshot_cache.hits, ('snapshot', 'miss'): snapshot_cache.misses,
+            ('thumbnail', 'hit'): image_fetcher.hits, ('thumbnail', 'miss'): image_fetcher.misses,
+            ('thumbnail', 'revalidated'): image_fetcher.revalidated,
+        },
+        kind='counter', labelnames=('cache', 'result')
+    )
+    metrics.callback('snapshot_cache_hit_ratio', 'Share of snapshot cache lookups that hit',
+                     lambda: snapshot_cache.stats()['hit_ratio'])
+    metrics.callback('snapshot_cache_bytes', 'Estimated size of the snapshot cache',
+                     lambda: snapshot_cache.stats()['bytes'])
+    metrics.callback('ytmusic_breaker_open', 'Whether the YouTube Music circuit breaker is open',
+                     lambda: int(not ytmusic_upstream.available))
+    metrics.callback('ytmusic_retries_total', 'Retried YouTube Music requests',
+                     lambda: ytmusic_upstream.retries, kind='counter')
+    metrics.callback('followed_playlists', 'Playlists followed by at least one subscriber',
+                     lambda: follow_index.stats()['playlists'])
+    metrics.callback('scheduled_playlists', 'Playlists being polled', lambda: poll_scheduler.stats()['playlists'])
+    metrics.callback('poll_deferred_playlists', 'Due playlists held back by the request budget',
+                     lambda: poll_scheduler.deferred)
+
+def build_application(builder=None):
+    """Create the Telegram application with every handler registered
+
+    builder defaults to one using TELEGRAM_BOT_TOKEN; the startup benchmark
+    passes its own with a fake connection to Telegram.
+    """
+    application = (builder or Application.builder().token(TELEGRAM_BOT_TOKEN)).build()
     
     # Create conversation handler for /setplaylist
     setplaylist_handler = ConversationHandler(
@@ -763,17 +1537,53 @@ def main():
     application.add_handler(CommandHandler("check", check_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("reset", reset_command))
+    application.add_handler(CommandHandler("history", history_command))
+    application.add_handler(CommandHandler("unfollow", unfollow_command))
+    application.add_handler(CommandHandler("list", list_command))
     application.add_handler(setplaylist_handler)
     
     # Add error handler
     application.add_error_handler(error_handler)
-    # Start Flask server for UptimeRobot
-    keep_alive()
-    print("🤖 Bot started successfully!")
     # Start periodic checking in background using post_init
     application.post_init = startup_task    
+    application.post_shutdown = shutdown_task
+    return application
+
+def main():
+    """Start the bot"""
+    # Import state left behind by the JSON file based versions
+    state_store.migrate_json_state(YOUTUBE_PLAYLIST_ID)
+    register_metrics()
+    cycle_profiler.install_signal_handler()
+    
+    # Create application
+    application = build_application()
+    
+    if POLL_WORKERS:
+        # Only one process may own Telegram; a second instance waits its turn
+        # instead of fighting over updates with Conflict errors
+        telegram_lease = Lease(state_store, 'telegram')
+        telegram_lease.wait()
+        shard_pool = ShardPool(POLL_WORKERS)
+        application.bot_data.update(telegram_lease=telegram_lease, shard_pool=shard_pool)
+        metrics.callback('poll_workers_alive', 'Polling worker processes running', lambda: shard_pool.alive)
+        metrics.callback('poll_worker_restarts_total', 'Polling worker processes restarted',
+                         lambda: shard_pool.restarts, kind='counter')
+    
+    log.info("🤖 Bot started successfully!")
     # Start the bot
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        # One async server for updates, health and metrics
+        try:
+            asyncio.run(run_webhook(application, ALLOWED_UPDATES))
+        except KeyboardInterrupt:
+            # uvicorn re-raises the Ctrl+C it already shut down for
+            pass
+    else:
+        # Start Flask server for UptimeRobot
+        from keep_alive import keep_alive
+        keep_alive()
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+# Snapshot cache settings
+SNAPSHOT_CACHE_TTL = int(os.getenv('SNAPSHOT_CACHE_TTL', 60))
+SNAPSHOT_CACHE_MAX_MB = float(os.getenv('SNAPSHOT_CACHE_MAX_MB', 32))
+# Memory budget of the saved snapshots kept warm for diffs and /status
+SAVED_SNAPSHOT_CACHE_MAX_MB = float(os.getenv('SAVED_SNAPSHOT_CACHE_MAX_MB', 32))
+
+
+def estimate_tracks_size(tracks):
+    """Estimate how many bytes a parsed track list keeps alive
+
+    Interned artists and thumbnails are counted for every track that uses
+    them, so shared strings make this an overestimate.
+    """
+    size = sys.getsizeof(tracks)
+    for track in tracks:
+        size += sys.getsizeof(track)
+        for value in track:
+            if isinstance(value, str):
+                size += sys.getsizeof(value)
+    return size
+
+
+class SnapshotCache:
+    """TTL cache of parsed playlist tracks with memory-bounded LRU eviction"""
+
+    def __init__(self, ttl=SNAPSHOT_CACHE_TTL, max_bytes=int(SNAPSHOT_CACHE_MAX_MB * 1024 * 1024)):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, playlist_id, max_age=None):
+        """Return cached tracks younger than max_age (the TTL by default), or None"""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            entry = self._entries.get(playlist_id)
+            if entry is None or time.monotonic() - entry[1] > max_age:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(playlist_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, playlist_id, tracks):
+        """Cache a track list, evicting the least recently used ones when over budget"""
+        size = estimate_tracks_size(tracks)
+        with self._lock:
+            self._discard(playlist_id)
+            if size > self.max_bytes:
+                return
+            self._entries[playlist_id] = (tracks, time.monotonic(), size)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate(self, playlist_id):
+        """Drop a playlist from the cache"""
+        with self._lock:
+            self._discard(playlist_id)
+
+    def _discard(self, playlist_id):
+        entry = self._entries.pop(playlist_id, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+    def stats(self):
+        """Counters for logging and status output"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+snapshot_cache = SnapshotCache()
+# Saved state of each playlist as last stored in the database; never expires,
+# callers check it against the stored fingerprint
+saved_snapshots = SnapshotCache(ttl=float('inf'), max_bytes=int(SAVED_SNAPSHOT_CACHE_MAX_MB * 1024 * 1024))
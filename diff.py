@@ -0,0 +1,178 @@
+import hashlib
+import operator
+from bisect import bisect_left
+from itertools import count, islice
+from collections import namedtuple
+
+_get_video_id = operator.attrgetter('videoId')
+
+
+class PlaylistDiff(namedtuple('PlaylistDiff', 'added removed moved duplicates events')):
+    """Changes between two versions of a playlist
+
+    added / removed: tracks whose videoId appeared in / disappeared from the playlist
+    moved: (old_position, new_position, track) for tracks that changed order
+    duplicates: (videoId, old_count, new_count, track) where an extra copy of a
+        song already in the playlist was added or removed
+    events: (action, position, track) edits that turn the old list into the new
+        one when replayed in order ('removed'/'move_out' at old positions,
+        then 'added'/'move_in' at new positions)
+    """
+    __slots__ = ()
+
+    @property
+    def changed(self):
+        """Whether the two versions differ at all"""
+        return bool(self.events)
+
+
+class Fingerprint:
+    """playlist_fingerprint built one videoId at a time, e.g. from raw pages as they stream in"""
+
+    def __init__(self):
+        self._digest = hashlib.blake2b(digest_size=16)
+
+    def add(self, video_id):
+        self._digest.update((video_id or '').encode())
+        self._digest.update(b'\n')
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+def playlist_fingerprint(tracks):
+    """Hash of the ordered videoIds of a track list"""
+    fingerprint = Fingerprint()
+    for track in tracks:
+        fingerprint.add(track.videoId)
+    return fingerprint.hexdigest()
+
+
+def _longest_increasing_run(values):
+    """Indexes of one longest strictly increasing subsequence of values"""
+    tails = []
+    tail_indexes = []
+    previous = [-1] * len(values)
+    for index, value in enumerate(values):
+        slot = bisect_left(tails, value)
+        if slot == len(tails):
+            tails.append(value)
+            tail_indexes.append(index)
+        else:
+            tails[slot] = value
+            tail_indexes[slot] = index
+        previous[index] = tail_indexes[slot - 1] if slot else -1
+
+    keep = set()
+    index = tail_indexes[-1] if tail_indexes else -1
+    while index != -1:
+        keep.add(index)
+        index = previous[index]
+    return keep
+
+
+def diff_playlists(old_tracks, new_tracks):
+    """Diff two track lists by videoId, counting duplicates and reorders
+
+    The k-th copy of a videoId in the new list is matched with the k-th copy in
+    the old list. Copies without a partner are adds/removes, and matched tracks
+    outside the longest run that kept its relative order count as moved. Runs in
+    O(n log n), so 10k+ track playlists are cheap.
+    """
+    old_ids = _video_ids(old_tracks)
+    new_ids = _video_ids(new_tracks)
+    if old_ids == new_ids:
+        return PlaylistDiff([], [], [], [], [])
+
+    old_index = dict(zip(old_ids, count()))
+    new_index = dict(zip(new_ids, count()))
+    if len(old_index) == len(old_ids) and len(new_index) == len(new_ids):
+        # No duplicates on either side: set and dict operations run at C speed
+        unmatched_new = sorted(new_index[video_id] for video_id in new_index.keys() - old_index.keys())
+        unmatched_old = sorted(old_index[video_id] for video_id in old_index.keys() - new_index.keys())
+        matched_old = list(map(old_index.get, new_ids))
+        matched_new = None
+        if unmatched_new:
+            matched_old = [position for position in matched_old if position is not None]
+        old_counts = new_counts = None
+    else:
+        matched_old, matched_new, unmatched_old, unmatched_new, old_counts, new_counts = _match_copies(old_ids, new_ids)
+
+    moved = []
+    if any(map(operator.ge, matched_old, islice(matched_old, 1, None))):
+        if matched_new is None:
+            skipped = set(unmatched_new)
+            matched_new = [position for position in range(len(new_ids)) if position not in skipped]
+        keep = _longest_increasing_run(matched_old)
+        moved = [
+            (old_position, new_position, new_tracks[new_position])
+            for index, (old_position, new_position) in enumerate(zip(matched_old, matched_new))
+            if index not in keep
+        ]
+
+    added = []
+    removed = []
+    duplicates = {}
+    for position in unmatched_new:
+        track = new_tracks[position]
+        video_id = new_ids[position]
+        if not video_id:
+            continue
+        if video_id in old_index:
+            duplicates[video_id] = (video_id, old_counts[video_id], new_counts[video_id], track)
+        else:
+            added.append(track)
+    for position in unmatched_old:
+        track = old_tracks[position]
+        video_id = old_ids[position]
+        if not video_id:
+            continue
+        if video_id in new_index:
+            duplicates[video_id] = (video_id, old_counts[video_id], new_counts[video_id], track)
+        else:
+            removed.append(track)
+
+    events = [('removed', position, old_tracks[position]) for position in unmatched_old]
+    events += [('move_out', old_position, track) for old_position, _, track in moved]
+    events.sort(key=lambda event: event[1], reverse=True)
+    insertions = [('added', position, new_tracks[position]) for position in unmatched_new]
+    insertions += [('move_in', new_position, track) for _, new_position, track in moved]
+    insertions.sort(key=lambda event: event[1])
+    events += insertions
+
+    return PlaylistDiff(added, removed, moved, list(duplicates.values()), events)
+
+
+def _video_ids(tracks):
+    """videoId of every track, in order"""
+    return list(map(_get_video_id, tracks))
+
+
+def _match_copies(old_ids, new_ids):
+    """Pair the k-th copy of each videoId in new_ids with its k-th copy in old_ids"""
+    old_positions = {}
+    for position, video_id in enumerate(old_ids):
+        old_positions.setdefault(video_id, []).append(position)
+
+    new_counts = {}
+    matched_old = []
+    matched_new = []
+    unmatched_new = []
+    for position, video_id in enumerate(new_ids):
+        seen = new_counts.get(video_id, 0)
+        new_counts[video_id] = seen + 1
+        candidates = old_positions.get(video_id)
+        if candidates is not None and seen < len(candidates):
+            matched_old.append(candidates[seen])
+            matched_new.append(position)
+        else:
+            unmatched_new.append(position)
+
+    unmatched_old = sorted(
+        position
+        for video_id, positions in old_positions.items()
+        for position in positions[new_counts.get(video_id, 0):]
+    )
+    old_counts = {video_id: len(positions) for video_id, positions in old_positions.items()}
+    return matched_old, matched_new, unmatched_old, unmatched_new, old_counts, new_counts
+
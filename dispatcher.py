@@ -0,0 +1,185 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import timedelta
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from tracing import span
+
+log = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and 1 per second per chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+SEND_CONCURRENCY = int(os.getenv('SEND_CONCURRENCY', 25))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', 3))
+
+# BadRequest messages that mean the chat is gone for good
+GONE_CHAT_ERRORS = ('chat not found', 'user not found', 'have no rights to send', 'not enough rights')
+# BadRequest messages that mean a cached Telegram file_id can't be sent anymore
+STALE_FILE_ERRORS = ('wrong file identifier', 'wrong remote file identifier', 'file reference expired')
+
+
+def is_stale_file_id(error):
+    """Whether Telegram rejected a message because of a file_id it no longer knows"""
+    return isinstance(error, BadRequest) and any(reason in str(error).lower() for reason in STALE_FILE_ERRORS)
+
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second, holding at most capacity"""
+
+    def __init__(self, rate, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        """Wait until enough tokens are available and take them"""
+        tokens = min(tokens, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    @property
+    def idle(self):
+        """Whether the bucket is full, i.e. it holds no rate-limit state worth keeping"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class FanoutDispatcher:
+    """Send messages to many chats concurrently within Telegram's rate limits
+
+    Every send takes a token from its chat's bucket and from the global one.
+    A RetryAfter pauses all sends for the requested time before retrying, and
+    chats that blocked the bot or no longer exist are passed to on_blocked.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 concurrency=SEND_CONCURRENCY, max_retries=SEND_MAX_RETRIES, on_blocked=None):
+        self.global_bucket = TokenBucket(global_rate, capacity=max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.on_blocked = on_blocked
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+        self.stats = {
+            'sent': 0,
+            'failed': 0,
+            'rate_limited': 0,
+            'blocked': 0,
+            'fanouts': 0,
+            'fanout_seconds': 0.0,
+            'last_fanout_seconds': 0.0,
+        }
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Forget chats that haven't been throttled lately
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items() if not value.idle}
+            bucket = TokenBucket(self.chat_rate)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _wait_for_flood_control(self):
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def send(self, chat_id, send_func, cost=1):
+        """Deliver one message with send_func(chat_id), returning True on success
+
+        cost is the number of messages the call produces (e.g. the photos of a
+        media group) and is charged against the global rate limit.
+        """
+        with span('send', chat_id=chat_id, cost=cost) as send_span:
+            delivered = await self._send(chat_id, send_func, cost)
+            send_span.set(delivered=delivered)
+            return delivered
+
+    async def _send(self, chat_id, send_func, cost):
+        for attempt in range(self.max_retries + 1):
+            await self._chat_bucket(chat_id).acquire()
+            await self._wait_for_flood_control()
+            await self.global_bucket.acquire(cost)
+            try:
+                await send_func(chat_id)
+                self.stats['sent'] += 1
+                return True
+            except RetryAfter as e:
+                self.stats['rate_limited'] += 1
+                # An int of seconds, or a timedelta in newer python-telegram-bot releases
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                log.warning(f"⏳ Flood control: pausing sends for {retry_after}s")
+            except Forbidden as e:
+                await self._drop_chat(chat_id, e)
+                return False
+            except BadRequest as e:
+                if any(reason in str(e).lower() for reason in GONE_CHAT_ERRORS):
+                    await self._drop_chat(chat_id, e)
+                else:
+                    log.error(f"Failed to send to {chat_id}: {e}")
+                    self.stats['failed'] += 1
+                return False
+            except NetworkError as e:
+                # Timeouts and connection errors are worth another try
+                log.warning(f"Network error sending to {chat_id} (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                log.error(f"Failed to send to {chat_id}: {e}")
+                self.stats['failed'] += 1
+                return False
+        self.stats['failed'] += 1
+        return False
+
+    async def _drop_chat(self, chat_id, error):
+        self.stats['blocked'] += 1
+        log.warning(f"🚫 Chat {chat_id} is unreachable ({error}) - unsubscribing")
+        if self.on_blocked:
+            try:
+                self.on_blocked(chat_id)
+            except Exception as e:
+                log.error(f"Error unsubscribing {chat_id}: {e}")
+
+    async def fan_out(self, chat_ids, send_func, cost=1):
+        """Send to every chat concurrently and return the number delivered"""
+        chat_ids = list(chat_ids)
+        if not chat_ids:
+            return 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+
+        async def deliver(chat_id):
+            async with semaphore:
+                return await self.send(chat_id, send_func, cost)
+
+        results = await asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids))
+        elapsed = time.monotonic() - started
+        self.stats['fanouts'] += 1
+        self.stats['fanout_seconds'] += elapsed
+        self.stats['last_fanout_seconds'] = elapsed
+        delivered = sum(results)
+        if len(chat_ids) > 1:
+            log.debug(f"📨 Delivered to {delivered}/{len(chat_ids)} chats in {elapsed:.1f}s")
+        return delivered
+
+    @property
+    def error_rate(self):
+        """Share of finished sends that failed or hit an unreachable chat"""
+        finished = self.stats['sent'] + self.stats['failed'] + self.stats['blocked']
+        return (self.stats['failed'] + self.stats['blocked']) / finished if finished else 0.0
@@ -0,0 +1,54 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Fetch engine settings
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', 4))
+YTMUSIC_CONCURRENCY = int(os.getenv('YTMUSIC_CONCURRENCY', 2))
+
+
+class FetchEngine:
+    """Run blocking upstream calls on a bounded thread pool
+
+    Every call is tagged with the upstream it talks to. Each upstream gets its
+    own concurrency limit so one slow service can't take every worker thread.
+    """
+
+    def __init__(self, max_workers=FETCH_WORKERS, limits=None):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch')
+        self._limits = dict(limits or {})
+        self._semaphores = {}
+        self._inflight = {}
+
+    def _semaphore(self, upstream):
+        """Get (or create) the concurrency limiter for an upstream"""
+        semaphore = self._semaphores.get(upstream)
+        if semaphore is None:
+            limit = min(self._limits.get(upstream, self.max_workers), self.max_workers)
+            semaphore = asyncio.Semaphore(limit)
+            self._semaphores[upstream] = semaphore
+        return semaphore
+
+    async def run(self, upstream, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the pool and await its result"""
+        async with self._semaphore(upstream):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def run_shared(self, key, upstream, func, *args, **kwargs):
+        """Like run(), but concurrent calls with the same key share one upstream call"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.run(upstream, func, *args, **kwargs))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def shutdown(self):
+        """Stop the worker threads, dropping calls that haven't started"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+fetch_engine = FetchEngine(limits={'ytmusic': YTMUSIC_CONCURRENCY})
@@ -0,0 +1,155 @@
+import os
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+# Playlists one chat can follow on top of the default one
+MAX_FOLLOWED_PLAYLISTS = int(os.getenv('MAX_FOLLOWED_PLAYLISTS', 10))
+
+
+class FollowIndex:
+    """In-memory index of who follows what, written through to the state store
+
+    Every subscriber follows the default playlist; chats can follow more with
+    /setplaylist. The index maps each playlist to its subscribed followers,
+    so the recipients of a diff are a lookup instead of a scan over every
+    chat. It is loaded from the store on first use and every subscription
+    and follow change goes through it to keep it current. Dicts are used as
+    ordered sets, so chats keep their subscription order.
+    """
+
+    def __init__(self, store, default_playlist_id):
+        self.store = store
+        self.default_playlist_id = default_playlist_id
+        self._subscribers = None
+        self._follows = {}
+        self._chats = {}
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if self._subscribers is None:
+            with self._lock:
+                if self._subscribers is None:
+                    self._build(self.store.get_subscribers(), self.store.get_followed_playlists())
+        return self._subscribers
+
+    def _build(self, subscribers, follows):
+        self._follows = {}
+        for chat_id, playlist_id in follows:
+            self._follows.setdefault(chat_id, {})[playlist_id] = None
+        self._chats = {}
+        self._subscribers = {}
+        for chat_id in subscribers:
+            self._add_subscriber(chat_id)
+
+    def reload(self):
+        """Rebuild the index from the store, for processes that don't see the changes"""
+        subscribers, follows = self.store.get_subscribers(), self.store.get_followed_playlists()
+        with self._lock:
+            self._build(subscribers, follows)
+
+    def _add_subscriber(self, chat_id):
+        self._subscribers[chat_id] = None
+        for playlist_id in self._follows.get(chat_id, ()):
+            self._chats.setdefault(playlist_id, {})[chat_id] = None
+
+    def _remove_chat(self, playlist_id, chat_id):
+        chats = self._chats.get(playlist_id)
+        if chats is not None:
+            chats.pop(chat_id, None)
+            if not chats:
+                del self._chats[playlist_id]
+
+    # Subscriptions
+
+    def subscribers(self):
+        """List subscribed chat IDs in subscription order"""
+        with self._lock:
+            return list(self._load())
+
+    def is_subscribed(self, chat_id):
+        return chat_id in self._load()
+
+    def subscribe(self, chat_id):
+        """Subscribe a chat, returning False if it already was"""
+        with self._lock:
+            self._load()
+            added = self.store.add_subscriber(chat_id)
+            if added:
+                self._add_subscriber(chat_id)
+            return added
+
+    def unsubscribe(self, chat_id):
+        """Unsubscribe a chat, keeping its playlists for when it comes back"""
+        with self._lock:
+            self._load()
+            removed = self.store.remove_subscriber(chat_id)
+            if chat_id in self._subscribers:
+                del self._subscribers[chat_id]
+                for playlist_id in self._follows.get(chat_id, ()):
+                    self._remove_chat(playlist_id, chat_id)
+            return removed
+
+    # Followed playlists
+
+    def playlists_of(self, chat_id):
+        """The default playlist and every playlist the chat added, in the order it added them"""
+        with self._lock:
+            self._load()
+            followed = [playlist_id for playlist_id in self._follows.get(chat_id, ())
+                        if playlist_id != self.default_playlist_id]
+        return [self.default_playlist_id] + followed
+
+    def follow(self, chat_id, playlist_id):
+        """Follow a playlist, returning False if the chat already did"""
+        if playlist_id == self.default_playlist_id:
+            return False
+        with self._lock:
+            self._load()
+            added = self.store.follow_playlist(chat_id, playlist_id)
+            self._follows.setdefault(chat_id, {})[playlist_id] = None
+            if chat_id in self._subscribers:
+                self._chats.setdefault(playlist_id, {})[chat_id] = None
+            return added
+
+    def unfollow(self, chat_id, playlist_id):
+        """Stop following a playlist, returning False if the chat didn't"""
+        with self._lock:
+            self._load()
+            removed = self.store.unfollow_playlist(chat_id, playlist_id)
+            followed = self._follows.get(chat_id)
+            if followed is not None:
+                followed.pop(playlist_id, None)
+                if not followed:
+                    del self._follows[chat_id]
+            self._remove_chat(playlist_id, chat_id)
+            return removed
+
+    # Routing
+
+    def recipients(self, playlist_id):
+        """Subscribed chats that follow a playlist, without scanning anyone else"""
+        with self._lock:
+            subscribers = self._load()
+            if playlist_id == self.default_playlist_id:
+                return list(subscribers)
+            return list(self._chats.get(playlist_id, ()))
+
+    def groups(self):
+        """Map every followed playlist to its subscribed followers"""
+        with self._lock:
+            groups = {self.default_playlist_id: list(self._load())}
+            for playlist_id, chats in self._chats.items():
+                if playlist_id != self.default_playlist_id:
+                    groups[playlist_id] = list(chats)
+            return groups
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {
+                'subscribers': len(self._subscribers),
+                'playlists': len(self._chats) + (self.default_playlist_id not in self._chats),
+                'follows': sum(len(playlists) for playlists in self._follows.values()),
+            }
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import httpx
+
+log = logging.getLogger(__name__)
+
+# Thumbnail downloader settings
+THUMBNAIL_CACHE_DIR = os.getenv('THUMBNAIL_CACHE_DIR', 'thumbnail_cache')
+THUMBNAIL_CACHE_MAX_MB = float(os.getenv('THUMBNAIL_CACHE_MAX_MB', 50))
+# Cached thumbnails older than this are revalidated with the server
+THUMBNAIL_REVALIDATE_AFTER = int(os.getenv('THUMBNAIL_REVALIDATE_AFTER', 7 * 86400))
+IMAGE_DOWNLOAD_CONCURRENCY = int(os.getenv('IMAGE_DOWNLOAD_CONCURRENCY', 8))
+
+
+class ImageFetcher:
+    """Async thumbnail downloader with a shared connection pool and a disk cache
+
+    Images are stored under cache_dir keyed by a hash of their URL, next to a
+    small .json file with the validators the server sent. The least recently
+    used images are deleted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir=THUMBNAIL_CACHE_DIR, max_bytes=int(THUMBNAIL_CACHE_MAX_MB * 1024 * 1024),
+                 concurrency=IMAGE_DOWNLOAD_CONCURRENCY, revalidate_after=THUMBNAIL_REVALIDATE_AFTER):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.revalidate_after = revalidate_after
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._client = None
+        self._semaphore = None
+        self._cache_size = None
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + '.img', base + '.json'
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=10,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    async def fetch(self, url):
+        """Return the image bytes for url, or None if it can't be downloaded"""
+        image_path, meta_path = self._paths(url)
+        cached = await asyncio.to_thread(self._read_cache, image_path, meta_path)
+        if cached is not None:
+            data, meta = cached
+            if time.time() - meta.get('fetched_at', 0) < self.revalidate_after:
+                self.hits += 1
+                return data
+        else:
+            data, meta = None, {}
+
+        headers = {}
+        if data is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        client = self._get_client()
+        try:
+            async with self._semaphore:
+                response = await client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            log.warning(f"Error downloading image: {e}")
+            # A stale copy beats no artwork at all
+            return data
+
+        if response.status_code == 304 and data is not None:
+            self.revalidated += 1
+            meta['fetched_at'] = time.time()
+            await asyncio.to_thread(self._write_meta, meta_path, meta)
+            return data
+        if response.status_code != 200:
+            log.warning(f"Error downloading image: HTTP {response.status_code}")
+            return data
+
+        self.misses += 1
+        data = response.content
+        meta = {
+            'url': url,
+            'fetched_at': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        await asyncio.to_thread(self._write_cache, image_path, meta_path, data, meta)
+        return data
+
+    def _read_cache(self, image_path, meta_path):
+        try:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # The image's mtime doubles as its last-used time for LRU eviction
+        os.utime(image_path)
+        return data, meta
+
+    def _write_meta(self, meta_path, meta):
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+    def _write_cache(self, image_path, meta_path, data, meta):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if self._cache_size is None:
+                self._cache_size = self._scan_size()
+            previous_size = os.path.getsize(image_path) if os.path.exists(image_path) else 0
+            tmp_path = image_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, image_path)
+            self._write_meta(meta_path, meta)
+            self._cache_size += len(data) - previous_size
+            if self._cache_size > self.max_bytes:
+                self._evict()
+        except OSError as e:
+            log.warning(f"Error caching image: {e}")
+
+    def _scan_size(self):
+        return sum(
+            entry.stat().st_size for entry in os.scandir(self.cache_dir)
+            if entry.name.endswith('.img')
+        )
+
+    def _evict(self):
+        """Delete least recently used images until the cache is at 90% of its budget"""
+        images = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.img')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        target = self.max_bytes * 0.9
+        for entry in images:
+            if self._cache_size <= target:
+                break
+            size = entry.stat().st_size
+            for path in (entry.path, entry.path[:-len('.img')] + '.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._cache_size -= size
+
+    async def close(self):
+        """Close the connection pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+image_fetcher = ImageFetcher()
@@ -1,5 +1,6 @@
-from flask import Flask
+from flask import Flask, Response
 from threading import Thread
+from metrics import metrics, health_report
 
 app = Flask('')
 
@@ -9,7 +10,11 @@ def home():
 
 @app.route('/health')
 def health():
-    return {"status": "healthy", "message": "Bot is running"}
+    return health_report()
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 def run():
     app.run(host='0.0.0.0', port=8080)
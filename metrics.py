@@ -0,0 +1,260 @@
+import os
+import time
+import asyncio
+import threading
+from resilience import ytmusic_upstream
+
+# /health reports unhealthy when no poll round succeeded for this long
+HEALTH_MAX_POLL_AGE = int(os.getenv('HEALTH_MAX_POLL_AGE', 600))
+# How often the event loop lag probe wakes up
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 1))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base of the metric types: a name, help text and one value per label set"""
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) for every exposed sample"""
+        with self._lock:
+            return [('', key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            labels = _format_labels(list(zip(self.labelnames, key)) + list(extra))
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    """Value that only goes up"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        """Current value, or None if it was never set"""
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing how long its block took"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+                samples.append(('_sum', key, (), total))
+                samples.append(('_count', key, (), count))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+class CallbackMetric(Metric):
+    """Metric read from func() at scrape time
+
+    func returns a number, or {label values tuple: number} for labelled metrics.
+    Handy for counters other modules already keep in their stats dicts.
+    """
+
+    def __init__(self, name, documentation, func, kind='gauge', labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+        self.kind = kind
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            return [('', key if isinstance(key, tuple) else (key,), (), item) for key, item in value.items()]
+        return [('', (), (), value)]
+
+
+class MetricsRegistry:
+    """Named metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, func, kind='gauge', labelnames=()):
+        return self._register(CallbackMetric(name, documentation, func, kind, labelnames))
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # One broken callback shouldn't take the whole endpoint down
+                lines.append(f'# {metric.name} unavailable: {type(e).__name__}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+fetch_seconds = metrics.histogram('ytmusic_fetch_seconds', 'Time to fetch and parse a playlist from YouTube Music')
+playlist_fetch_seconds = metrics.gauge(
+    'ytmusic_playlist_last_fetch_seconds', 'Duration of the latest fetch of each playlist', ('playlist_id',)
+)
+fetch_errors = metrics.counter('ytmusic_fetch_errors_total', 'Failed playlist fetches by cause', ('cause',))
+tracks_parsed = metrics.counter('tracks_parsed_total', 'Tracks parsed from YouTube Music responses')
+diff_seconds = metrics.histogram('diff_seconds', 'Time to diff a playlist against its saved snapshot')
+poll_cycle_seconds = metrics.histogram(
+    'poll_cycle_seconds', 'Duration of a polling round', buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+poll_last_success = metrics.gauge('poll_last_success_timestamp_seconds', 'Unix time of the last successful polling round')
+loop_lag_seconds = metrics.histogram(
+    'event_loop_lag_seconds', 'How late the event loop ran a timer it was due to run',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+loop_lag_last = metrics.gauge('event_loop_lag_last_seconds', 'Event loop lag measured by the latest probe')
+
+
+started_at = time.time()
+
+
+def record_poll_success():
+    """Mark a polling round as done, for /health"""
+    poll_last_success.set(time.time())
+
+
+def poll_age():
+    """Seconds since the last successful polling round, or None before the first one"""
+    last = poll_last_success.value()
+    return None if last is None else time.time() - last
+
+
+def health_report():
+    """(body, HTTP status) of the liveness check served on /health
+
+    Unhealthy once no polling round succeeded for HEALTH_MAX_POLL_AGE
+    seconds, degraded while the circuit breaker keeps YouTube Music off.
+    """
+    upstream = ytmusic_upstream.stats()
+    # Before the first polling round, count from startup
+    age = poll_age()
+    if age is None:
+        age = time.time() - started_at
+    body = {"last_poll_age": round(age, 1), "upstream": upstream}
+    if age > HEALTH_MAX_POLL_AGE:
+        return dict(body, status="unhealthy", message=f"No successful poll for {age:.0f}s"), 503
+    if upstream['state'] == 'open':
+        # Still up and serving saved state, but not seeing playlist changes
+        return dict(body, status="degraded", message="YouTube Music unavailable"), 200
+    return dict(body, status="healthy", message="Bot is running"), 200
+
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """Measure how late the event loop wakes up from a sleep, forever
+
+    A busy loop (a blocking call, a long parse) delays every timer, so the
+    overshoot of this one is the delay every handler is seeing.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        loop_lag_seconds.observe(lag)
+        loop_lag_last.set(lag)
@@ -0,0 +1,105 @@
+from ytmusicapi.continuations import CONTINUATION_ITEMS, get_continuation_token
+from ytmusicapi.navigation import (
+    CONTENT, EDITABLE_PLAYLIST_DETAIL_HEADER, HEADER, RESPONSIVE_HEADER, SECTION,
+    SECTION_LIST_ITEM, TAB_CONTENT, TWO_COLUMN_RENDERER, nav
+)
+from ytmusicapi.parsers.playlists import parse_playlist_header_meta, parse_playlist_items
+
+
+class PlaylistPages:
+    """Iterate over a playlist's raw ytmusicapi tracks one continuation page at a time
+
+    ytmusic.get_playlist() collects every page before returning, so a large
+    playlist sits in memory as one big list of raw track dicts. This walks the
+    same browse/continuation requests but yields each page as soon as it
+    arrives, so callers can parse it and let the raw data go.
+
+    After iterating, track_count is the song count shown in the playlist
+    header (None if it couldn't be read), fetched the number of tracks
+    received, and complete whether the continuation chain ended normally.
+
+    With max_pages, iteration stops after that many pages without requesting
+    the rest; complete then stays False if the playlist had more.
+    """
+
+    # Tracks on one page of YouTube Music's playlist browse responses
+    PAGE_SIZE = 100
+
+    def __init__(self, ytmusic, playlist_id, max_pages=None):
+        self.ytmusic = ytmusic
+        self.playlist_id = playlist_id
+        self.max_pages = max_pages
+        self.track_count = None
+        self.fetched = 0
+        self.pages = 0
+        self.complete = False
+
+    def __iter__(self):
+        for page in self._pages():
+            self.pages += 1
+            self.fetched += len(page)
+            yield page
+            if self.pages == self.max_pages:
+                return
+
+    @property
+    def truncated(self):
+        """Whether fewer tracks came back than the playlist holds"""
+        if not self.complete:
+            return True
+        return self.track_count is not None and self.fetched < self.track_count
+
+    def _request(self, body):
+        return self.ytmusic._send_request('browse', body)
+
+    def _pages(self):
+        browse_id = self.playlist_id if self.playlist_id.startswith('VL') else 'VL' + self.playlist_id
+        response = self._request({'browseId': browse_id})
+        try:
+            header_data = nav(response, [*TWO_COLUMN_RENDERER, *TAB_CONTENT, *SECTION_LIST_ITEM])
+            section_list = nav(response, [*TWO_COLUMN_RENDERER, 'secondaryContents', *SECTION])
+        except (KeyError, IndexError, TypeError):
+            # Album audio playlists and layouts we don't know: let ytmusicapi handle them
+            yield from self._fallback()
+            return
+
+        if EDITABLE_PLAYLIST_DETAIL_HEADER[0] in header_data:
+            header = nav(header_data, [*EDITABLE_PLAYLIST_DETAIL_HEADER, *HEADER, *RESPONSIVE_HEADER], True)
+        else:
+            header = nav(header_data, RESPONSIVE_HEADER, True)
+        meta = parse_playlist_header_meta(header) if header else {}
+        self.track_count = meta.get('trackCount')
+        is_collaborative = 'collaborators' in meta
+
+        content_data = nav(section_list, [*CONTENT, 'musicPlaylistShelfRenderer'], True)
+        if not content_data or 'contents' not in content_data:
+            self.complete = True
+            return
+
+        contents = content_data['contents']
+        seen_tokens = set()
+        while True:
+            page = parse_playlist_items(contents, is_collaborative=is_collaborative)
+            token = get_continuation_token(contents) if contents else None
+            del contents
+            if page:
+                yield page
+            if not token:
+                self.complete = True
+                return
+            if token in seen_tokens or not page:
+                # YouTube sent a continuation that goes nowhere
+                return
+            seen_tokens.add(token)
+            contents = nav(self._request({'continuation': token}), CONTINUATION_ITEMS, True)
+            if not contents:
+                return
+
+    def _fallback(self):
+        limit = None if self.max_pages is None else self.max_pages * self.PAGE_SIZE
+        playlist = self.ytmusic.get_playlist(self.playlist_id, limit=limit)
+        self.track_count = playlist.get('trackCount')
+        tracks = playlist.get('tracks') or []
+        self.complete = limit is None or self.track_count is None or len(tracks) >= self.track_count
+        if tracks:
+            yield tracks
@@ -0,0 +1,211 @@
+import os
+import time
+import random
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+# Retries of a failed upstream call, with full-jitter exponential backoff
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', 3))
+UPSTREAM_RETRY_BASE = float(os.getenv('UPSTREAM_RETRY_BASE', 1))
+UPSTREAM_RETRY_MAX = float(os.getenv('UPSTREAM_RETRY_MAX', 30))
+# Consecutive failures after which a playlist is no longer retried
+PLAYLIST_ERROR_BUDGET = int(os.getenv('PLAYLIST_ERROR_BUDGET', 5))
+# Consecutive upstream failures that open the circuit breaker, and how long it stays open
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 60))
+BREAKER_MAX_RESET_TIMEOUT = float(os.getenv('BREAKER_MAX_RESET_TIMEOUT', 900))
+
+
+class TransientUpstreamError(Exception):
+    """An upstream failure worth retrying that isn't an HTTP or connection error"""
+
+
+class IncompleteResponseError(Exception):
+    """Upstream answered, but with less than the whole resource
+
+    Not transient: it says nothing about upstream's health, so it only
+    counts against the error budget of the key it happened to.
+    """
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling upstream while the circuit breaker is open"""
+
+
+def is_transient(error):
+    """Whether an error means upstream is struggling, rather than a bad request
+
+    Connection problems, timeouts, throttling (429) and server errors (5xx)
+    are transient. Anything else, such as a 404 for a deleted playlist, is a
+    problem with that one request.
+    """
+    # Imported here so loading this module doesn't pull in ytmusicapi at startup
+    import requests
+    from ytmusicapi.exceptions import YTMusicServerError
+
+    if isinstance(error, (TransientUpstreamError, requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, YTMusicServerError):
+        message = str(error)
+        return 'HTTP 429' in message or 'HTTP 5' in message
+    return False
+
+
+def backoff_delay(attempt, base=UPSTREAM_RETRY_BASE, cap=UPSTREAM_RETRY_MAX):
+    """Full-jitter exponential backoff: a random delay up to base * 2^attempt, at most cap"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Stop calling an upstream that keeps failing
+
+    After failure_threshold consecutive failures the breaker opens and calls
+    are refused for reset_timeout seconds. Then one probe call is let through
+    (half open): success closes the breaker, failure opens it again for twice
+    as long, up to max_reset_timeout.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT,
+                 max_reset_timeout=BREAKER_MAX_RESET_TIMEOUT):
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max(reset_timeout, max_reset_timeout)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self._state = self.CLOSED
+        self._probing = False
+        self._probe_started = 0.0
+
+    @property
+    def state(self):
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    @property
+    def retry_in(self):
+        """Seconds until the breaker lets a probe through, 0 if it isn't open"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        """Whether a call may go upstream now; claims the probe when half open"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        # A probe that never reported back (e.g. it was cancelled) is replaced
+        now = time.monotonic()
+        if state == self.HALF_OPEN and (not self._probing or now - self._probe_started > self.reset_timeout):
+            self._probing = True
+            self._probe_started = now
+            return True
+        return False
+
+    def record_success(self):
+        if self._state != self.CLOSED:
+            log.info("✅ Upstream recovered - circuit breaker closed")
+        self._state = self.CLOSED
+        self._probing = False
+        self._probe_started = 0.0
+        self.failures = 0
+        self.reset_timeout = self.base_reset_timeout
+
+    def record_failure(self):
+        self.failures += 1
+        if self._state == self.HALF_OPEN:
+            self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+            self._open()
+        elif self._state == self.CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._probing = False
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        log.warning(f"⛔ Circuit breaker open after {self.failures} failures - pausing upstream calls "
+                    f"for {self.reset_timeout:.0f}s")
+
+    def stats(self):
+        """Breaker state for /status and the health endpoint"""
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'trips': self.trips,
+            'retry_in': round(self.retry_in, 1),
+        }
+
+
+class UpstreamGuard:
+    """Retries, per-key error budgets and a circuit breaker around one upstream
+
+    call() retries transient failures with jittered backoff. Keys (playlist
+    IDs) that failed error_budget times in a row are tried once per call
+    instead, so a deleted playlist can't keep upstream busy. Every transient
+    failure also counts towards the shared circuit breaker.
+    """
+
+    def __init__(self, breaker=None, max_retries=UPSTREAM_MAX_RETRIES, error_budget=PLAYLIST_ERROR_BUDGET):
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.error_budget = error_budget
+        self.retries = 0
+        self.rejected = 0
+        self._errors = {}
+
+    @property
+    def available(self):
+        """Whether calls can currently go upstream"""
+        return self.breaker.state != CircuitBreaker.OPEN
+
+    def over_budget(self, key):
+        """Whether key has used up its error budget"""
+        return self._errors.get(key, 0) >= self.error_budget
+
+    async def call(self, key, func, *args):
+        """Await func(*args), retrying transient failures; raises UpstreamUnavailable when the breaker is open"""
+        attempts = 1 if self.over_budget(key) else self.max_retries + 1
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise UpstreamUnavailable(f"circuit breaker {self.breaker.state}")
+            try:
+                result = await func(*args)
+            except Exception as e:
+                self._errors[key] = self._errors.get(key, 0) + 1
+                if not is_transient(e):
+                    # Upstream answered; the request itself was bad
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt + 1 == attempts:
+                    raise
+                delay = backoff_delay(attempt)
+                self.retries += 1
+                log.warning(f"🔁 Upstream error for {key} ({type(e).__name__}: {e}) - retry {attempt + 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                self._errors.pop(key, None)
+                return result
+
+    def stats(self):
+        """Breaker state plus retry and error budget counters"""
+        return dict(
+            self.breaker.stats(),
+            retries=self.retries,
+            rejected=self.rejected,
+            over_budget=sum(1 for count in self._errors.values() if count >= self.error_budget),
+        )
+
+
+ytmusic_upstream = UpstreamGuard()
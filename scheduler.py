@@ -0,0 +1,221 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# Scheduler settings
+POLL_CONCURRENCY = int(os.getenv('POLL_CONCURRENCY', 8))
+# Fraction of the cycle length the polls of one cycle are spread across
+POLL_SPREAD = float(os.getenv('POLL_SPREAD', 0.8))
+# Adaptive polling: idle playlists back off towards the max interval, a
+# change drops a playlist back to the min interval
+POLL_MIN_INTERVAL = int(os.getenv('POLL_MIN_INTERVAL', 60))
+POLL_MAX_INTERVAL = int(os.getenv('POLL_MAX_INTERVAL', 3600))
+POLL_BACKOFF = float(os.getenv('POLL_BACKOFF', 2))
+# Per-playlist overrides as "playlist_id=min:max,playlist_id=min:max"
+POLL_INTERVAL_BOUNDS = os.getenv('POLL_INTERVAL_BOUNDS', '')
+# Most playlist polls per hour across all playlists (0 = no limit)
+POLL_REQUEST_BUDGET = int(os.getenv('POLL_REQUEST_BUDGET', 0))
+
+
+def parse_interval_bounds(value):
+    """Parse POLL_INTERVAL_BOUNDS into {playlist_id: (min_interval, max_interval)}"""
+    bounds = {}
+    for entry in value.split(','):
+        playlist_id, _, limits = entry.strip().partition('=')
+        if not playlist_id or not limits:
+            continue
+        try:
+            low, _, high = limits.partition(':')
+            low = int(low)
+            bounds[playlist_id] = (low, int(high) if high else max(low, POLL_MAX_INTERVAL))
+        except ValueError:
+            log.warning(f"⚠️ Ignoring invalid POLL_INTERVAL_BOUNDS entry: {entry}")
+    return bounds
+
+
+class PlaylistSchedule:
+    """Polling state of one playlist"""
+    __slots__ = ('interval', 'next_due', 'last_polled', 'last_changed', 'polls', 'changes')
+
+    def __init__(self, interval, next_due):
+        self.interval = interval
+        self.next_due = next_due
+        self.last_polled = None
+        self.last_changed = None
+        self.polls = 0
+        self.changes = 0
+
+
+class PollScheduler:
+    """Decide which playlists are due and spread their polls across a cycle
+
+    Every playlist has its own interval. It starts at initial_interval, is
+    multiplied by backoff each time a poll finds nothing new and drops to the
+    playlist's minimum as soon as one finds a change, always staying within
+    that playlist's [min, max] bounds. With a request budget, polls beyond
+    the hourly allowance are deferred, most overdue playlists going first.
+
+    Job i of n in a cycle starts at i * (window * spread) / n seconds, and at
+    most max_concurrency polls run at the same time. The duration of every
+    cycle is kept so slow cycles can be spotted as the number of jobs grows.
+    """
+
+    def __init__(self, initial_interval, max_concurrency=POLL_CONCURRENCY, spread=POLL_SPREAD, history=50,
+                 min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL, backoff=POLL_BACKOFF,
+                 bounds=None, request_budget=POLL_REQUEST_BUDGET):
+        self.initial_interval = initial_interval
+        self.max_concurrency = max(1, max_concurrency)
+        self.spread = min(max(spread, 0.0), 1.0)
+        self.cycles = deque(maxlen=history)
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = max(1.0, backoff)
+        self.bounds = parse_interval_bounds(POLL_INTERVAL_BOUNDS) if bounds is None else bounds
+        self.request_budget = request_budget
+        self.deferred = 0
+        self._schedules = {}
+        self._budget_tokens = None
+        self._budget_updated = time.monotonic()
+
+    def _bounds_for(self, playlist_id):
+        return self.bounds.get(playlist_id, (self.min_interval, self.max_interval))
+
+    def _schedule(self, playlist_id, now):
+        schedule = self._schedules.get(playlist_id)
+        if schedule is None:
+            low, high = self._bounds_for(playlist_id)
+            # New playlists are polled right away
+            schedule = PlaylistSchedule(min(max(self.initial_interval, low), high), now)
+            self._schedules[playlist_id] = schedule
+        return schedule
+
+    def _take_budget(self, wanted, now):
+        """How many of wanted polls the hourly request budget allows right now"""
+        if self.request_budget <= 0:
+            return wanted
+        rate = self.request_budget / 3600
+        # Allow a burst of up to one minimum interval's worth of polls
+        capacity = max(1.0, rate * self.min_interval)
+        if self._budget_tokens is None:
+            self._budget_tokens = capacity
+        else:
+            self._budget_tokens = min(capacity, self._budget_tokens + (now - self._budget_updated) * rate)
+        self._budget_updated = now
+        allowed = min(wanted, int(self._budget_tokens))
+        self._budget_tokens -= allowed
+        return allowed
+
+    def due(self, playlist_ids, now=None):
+        """The playlists among playlist_ids that should be polled now, most overdue first
+
+        Playlists that are no longer followed are forgotten.
+        """
+        now = time.monotonic() if now is None else now
+        playlist_ids = set(playlist_ids)
+        for playlist_id in list(self._schedules):
+            if playlist_id not in playlist_ids:
+                del self._schedules[playlist_id]
+        due = []
+        for playlist_id in playlist_ids:
+            schedule = self._schedule(playlist_id, now)
+            if schedule.next_due <= now:
+                due.append((schedule.next_due, playlist_id))
+        due.sort()
+        allowed = self._take_budget(len(due), now)
+        self.deferred = len(due) - allowed
+        return [playlist_id for _, playlist_id in due[:allowed]]
+
+    def record(self, playlist_id, changed, now=None):
+        """Update a playlist's interval after a poll; changed is None if the poll failed"""
+        now = time.monotonic() if now is None else now
+        schedule = self._schedule(playlist_id, now)
+        low, high = self._bounds_for(playlist_id)
+        schedule.last_polled = now
+        schedule.polls += 1
+        if changed:
+            schedule.changes += 1
+            schedule.last_changed = now
+            schedule.interval = low
+        elif changed is not None:
+            schedule.interval = min(max(schedule.interval * self.backoff, low), high)
+        schedule.next_due = now + schedule.interval
+
+    def interval_for(self, playlist_id):
+        """Current polling interval of a playlist in seconds, or None if it isn't scheduled"""
+        schedule = self._schedules.get(playlist_id)
+        return schedule.interval if schedule else None
+
+    def seconds_until_due(self, now=None):
+        """Time until the next playlist is due, capped at the minimum interval
+
+        The cap keeps newly followed playlists from waiting long for their first poll.
+        """
+        now = time.monotonic() if now is None else now
+        wait = self.min_interval
+        for schedule in self._schedules.values():
+            wait = min(wait, schedule.next_due - now)
+        return max(0.0, wait)
+
+    def stats(self):
+        """How the scheduled playlists' intervals are spread between their bounds"""
+        at_min = at_max = total = 0
+        for playlist_id, schedule in self._schedules.items():
+            low, high = self._bounds_for(playlist_id)
+            at_min += schedule.interval <= low
+            at_max += schedule.interval >= high
+            total += schedule.interval
+        count = len(self._schedules)
+        return {
+            'playlists': count,
+            'at_min': at_min,
+            'at_max': at_max,
+            'mean_interval': total / count if count else 0.0,
+            'deferred': self.deferred,
+        }
+
+    async def run_cycle(self, jobs, poll, window=None):
+        """Run poll(*job) for every job, spread across window seconds, and return the cycle stats
+
+        A job fails if poll raises or returns False.
+        """
+        jobs = list(jobs)
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        window = self.initial_interval if window is None else window
+        step = window * self.spread / len(jobs) if jobs else 0
+        started = loop.time()
+        failures = 0
+
+        async def run_job(index, job):
+            nonlocal failures
+            delay = started + index * step - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with semaphore:
+                try:
+                    if await poll(*job) is False:
+                        failures += 1
+                except Exception as e:
+                    failures += 1
+                    log.error(f"❌ Poll failed for {job}: {type(e).__name__}: {e}")
+
+        await asyncio.gather(*(run_job(index, job) for index, job in enumerate(jobs)))
+
+        stats = {
+            'finished_at': time.time(),
+            'jobs': len(jobs),
+            'failures': failures,
+            'duration': loop.time() - started,
+        }
+        self.cycles.append(stats)
+        log.info(f"⏱️ Poll cycle finished: {stats['jobs']} playlists in {stats['duration']:.1f}s ({failures} failed)")
+        return stats
+
+    @property
+    def last_cycle(self):
+        """Stats of the most recent cycle, or None before the first one"""
+        return self.cycles[-1] if self.cycles else None
@@ -0,0 +1,151 @@
+import os
+import sys
+import zlib
+import time
+import queue
+import socket
+import asyncio
+import logging
+import multiprocessing
+
+log = logging.getLogger(__name__)
+
+# Worker processes that poll playlists; 0 polls in the bot process itself
+POLL_WORKERS = int(os.getenv('POLL_WORKERS', 0))
+# Seconds a shard or Telegram lease lasts without being renewed
+LEASE_TTL = float(os.getenv('LEASE_TTL', 30))
+
+
+def shard_of(playlist_id, shards):
+    """Shard a playlist belongs to, the same in every process (unlike hash())"""
+    return zlib.crc32(playlist_id.encode()) % shards
+
+
+class Lease:
+    """A named lease in the state store, held by this process while it keeps renewing it
+
+    It is renewed every third of its ttl, so a process that dies or stalls
+    loses it within ttl seconds and another process can take over.
+    """
+
+    def __init__(self, store, name, ttl=LEASE_TTL):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.held = False
+
+    def renew(self):
+        """Take or renew the lease; returns whether this process holds it"""
+        try:
+            held = self.store.acquire_lease(self.name, self.owner, self.ttl)
+        except Exception as e:
+            log.error(f"Error renewing lease {self.name}: {e}")
+            held = False
+        if held and not self.held:
+            log.info(f"🔑 Acquired lease {self.name}")
+        elif self.held and not held:
+            log.warning(f"🔑 Lost lease {self.name}")
+        self.held = held
+        return held
+
+    async def keep(self):
+        """Renew the lease forever"""
+        while True:
+            self.renew()
+            await asyncio.sleep(self.ttl / 3)
+
+    def wait(self):
+        """Block until the lease is free and taken"""
+        while not self.renew():
+            log.warning(f"⏳ Lease {self.name} is held by another process - waiting")
+            time.sleep(self.ttl / 3)
+
+    def release(self):
+        if self.held:
+            self.held = False
+            try:
+                self.store.release_lease(self.name, self.owner)
+            except Exception as e:
+                log.error(f"Error releasing lease {self.name}: {e}")
+
+
+def run_worker(shard, shards, reports, stop):
+    """Entry point of a polling worker process"""
+    # The spawned process has already run the bot's script as __mp_main__;
+    # reuse it rather than importing (and initializing) it a second time
+    bot = sys.modules.get('__mp_main__')
+    if not hasattr(bot, 'poll_shard'):
+        import bot
+    asyncio.run(bot.poll_shard(shard, shards, reports, stop))
+
+
+class ShardPool:
+    """Worker processes that each poll one shard of the playlists
+
+    Workers send their reports back over a queue; the bot process reads them
+    with reports_forever() and restarts workers that died.
+    """
+
+    def __init__(self, workers=POLL_WORKERS):
+        self.workers = workers
+        # spawn: forking a process that has threads and an open database isn't safe
+        self._context = multiprocessing.get_context('spawn')
+        self.reports = self._context.Queue()
+        self._stop = self._context.Event()
+        self._processes = {}
+        self.restarts = 0
+
+    def _spawn(self, shard):
+        process = self._context.Process(
+            target=run_worker, args=(shard, self.workers, self.reports, self._stop),
+            name=f'poll-shard-{shard}', daemon=True
+        )
+        process.start()
+        self._processes[shard] = process
+
+    def start(self):
+        for shard in range(self.workers):
+            self._spawn(shard)
+        log.info(f"🧩 Started {self.workers} polling workers")
+
+    def supervise(self):
+        """Restart workers that exited"""
+        if self._stop.is_set():
+            return
+        for shard, process in list(self._processes.items()):
+            if not process.is_alive():
+                log.warning(f"🧩 Polling worker {shard} exited with code {process.exitcode} - restarting")
+                self.restarts += 1
+                self._spawn(shard)
+
+    @property
+    def alive(self):
+        return sum(1 for process in self._processes.values() if process.is_alive())
+
+    async def reports_forever(self, handle, supervise_every=5):
+        """Call handle(*report) for every worker report, checking on the workers meanwhile"""
+        loop = asyncio.get_running_loop()
+        supervised = time.monotonic()
+        while True:
+            try:
+                report = await loop.run_in_executor(None, self.reports.get, True, 1)
+            except queue.Empty:
+                report = None
+            if report is not None:
+                try:
+                    handle(*report)
+                except Exception as e:
+                    log.error(f"Error handling worker report {report}: {e}")
+            if time.monotonic() - supervised >= supervise_every:
+                supervised = time.monotonic()
+                self.supervise()
+
+    def stop(self, timeout=10):
+        """Ask the workers to finish, terminating the ones that don't in time"""
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes.values():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,637 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from diff import playlist_fingerprint
+from track import Track
+
+log = logging.getLogger(__name__)
+
+DATABASE_FILE = os.getenv('DATABASE_FILE', 'bot_state.db')
+# Where the old JSON state files are moved once they have been imported
+JSON_BACKUP_DIR = 'json_backup'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS subscribers (
+    chat_id INTEGER PRIMARY KEY,
+    subscribed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat_playlists (
+    chat_id INTEGER NOT NULL,
+    playlist_id TEXT NOT NULL,
+    followed_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, playlist_id)
+);
+CREATE INDEX IF NOT EXISTS idx_chat_playlists_playlist ON chat_playlists (playlist_id);
+CREATE TABLE IF NOT EXISTS snapshots (
+    playlist_id TEXT PRIMARY KEY,
+    track_count INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshot_tracks (
+    playlist_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    video_id TEXT,
+    title TEXT,
+    artists TEXT,
+    thumbnail TEXT,
+    PRIMARY KEY (playlist_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_snapshot_tracks_video ON snapshot_tracks (playlist_id, video_id);
+CREATE TABLE IF NOT EXISTS snapshot_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    playlist_id TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    action TEXT NOT NULL,
+    position INTEGER,
+    video_id TEXT,
+    title TEXT,
+    artists TEXT,
+    thumbnail TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_snapshot_events_playlist ON snapshot_events (playlist_id, id);
+CREATE TABLE IF NOT EXISTS thumbnail_file_ids (
+    url TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    playlist_id TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    action TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (playlist_id, video_id, action, chat_id)
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# Columns added after a table was first released: (table, column, definition)
+ADDED_COLUMNS = [
+    ('snapshots', 'base_event_id', 'INTEGER NOT NULL DEFAULT 0'),
+    ('snapshots', 'pending_events', 'INTEGER NOT NULL DEFAULT 0'),
+    ('snapshots', 'fingerprint', 'TEXT'),
+]
+
+# Fold the change log into the base snapshot after this many events
+SNAPSHOT_COMPACT_EVENTS = int(os.getenv('SNAPSHOT_COMPACT_EVENTS', 500))
+# Change history older than this is dropped when a snapshot is compacted
+SNAPSHOT_HISTORY_DAYS = int(os.getenv('SNAPSHOT_HISTORY_DAYS', 90))
+
+
+def apply_events(tracks, events):
+    """Replay (action, position, track) change events on top of a track list
+
+    'removed' and 'move_out' drop the track at its old position (or the first
+    copy of its videoId if the position doesn't match); 'added' and 'move_in'
+    insert the track at its position in the new playlist.
+    """
+    tracks = list(tracks)
+    for action, position, track in events:
+        if action in ('removed', 'move_out'):
+            video_id = track.videoId
+            if position is not None and position < len(tracks) and tracks[position].videoId == video_id:
+                del tracks[position]
+                continue
+            for index, existing in enumerate(tracks):
+                if existing.videoId == video_id:
+                    del tracks[index]
+                    break
+        elif action in ('added', 'move_in'):
+            tracks.insert(len(tracks) if position is None else position, track)
+    return tracks
+
+
+class StateStore:
+    """SQLite store for subscribers, followed playlists and playlist snapshots
+
+    Writes share one connection guarded by a lock, and every write runs in a
+    transaction, so concurrent handlers can't lose each other's updates the
+    way they could with whole JSON file rewrites. Reads outside a
+    transaction go through a connection of their own per thread: WAL lets
+    them run alongside a write, so a long transaction on the fetch engine
+    doesn't hold up lookups made on the event loop.
+    """
+
+    def __init__(self, path=DATABASE_FILE):
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._readers = []
+
+    @property
+    def conn(self):
+        """Open the database and create the schema on first use"""
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.execute('PRAGMA synchronous=NORMAL')
+                    conn.executescript(SCHEMA)
+                    for table, column, definition in ADDED_COLUMNS:
+                        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+                        if column not in columns:
+                            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                    if self._has_table(conn, 'user_playlists'):
+                        self._migrate_user_playlists(conn)
+                    if not self._outbox_keyed_by_playlist(conn):
+                        self._migrate_outbox_key(conn)
+                    self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _has_table(conn, name):
+        return bool(conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchall())
+
+    def _migrate_user_playlists(self, conn):
+        """Move the one custom playlist per chat of older versions into chat_playlists"""
+        conn.execute('BEGIN IMMEDIATE')
+        # Another process may have moved them while this one waited for the lock
+        if self._has_table(conn, 'user_playlists'):
+            conn.execute(
+                'INSERT OR IGNORE INTO chat_playlists (chat_id, playlist_id, followed_at) '
+                'SELECT chat_id, playlist_id, updated_at FROM user_playlists'
+            )
+            conn.execute('DROP TABLE user_playlists')
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def _outbox_keyed_by_playlist(conn):
+        for _, name, unique, *_ in conn.execute('PRAGMA index_list(outbox)').fetchall():
+            if unique and 'playlist_id' in {row[2] for row in conn.execute(f'PRAGMA index_info({name})')}:
+                return True
+        return False
+
+    def _migrate_outbox_key(self, conn):
+        """Rebuild an outbox whose rows were unique per chat and song, not per playlist too"""
+        conn.execute('BEGIN IMMEDIATE')
+        if not self._outbox_keyed_by_playlist(conn):
+            create_outbox = SCHEMA[SCHEMA.index('CREATE TABLE IF NOT EXISTS outbox'):]
+            create_outbox = create_outbox[:create_outbox.index(';')]
+            conn.execute('ALTER TABLE outbox RENAME TO outbox_old')
+            conn.execute(create_outbox)
+            conn.execute(
+                'INSERT OR IGNORE INTO outbox (id, chat_id, playlist_id, video_id, action, payload, created_at, attempts) '
+                'SELECT id, chat_id, playlist_id, video_id, action, payload, created_at, attempts FROM outbox_old'
+            )
+            conn.execute('DROP TABLE outbox_old')
+        conn.execute('COMMIT')
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of statements atomically"""
+        with self._lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def _reader(self):
+        """This thread's read connection, opened once the schema is in place"""
+        reader = getattr(self._local, 'conn', None)
+        if reader is None:
+            self.conn
+            reader = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            with self._lock:
+                self._readers.append(reader)
+            self._local.conn = reader
+        return reader
+
+    def _query(self, sql, params=()):
+        return self._reader().execute(sql, params).fetchall()
+
+    def close(self):
+        """Close the database connections"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            for reader in self._readers:
+                reader.close()
+            self._readers = []
+            self._local = threading.local()
+
+    # Subscribers
+
+    def get_subscribers(self):
+        """List subscribed chat IDs in subscription order"""
+        return [row[0] for row in self._query('SELECT chat_id FROM subscribers ORDER BY subscribed_at, chat_id')]
+
+    def is_subscribed(self, chat_id):
+        """Check whether a chat is subscribed"""
+        return bool(self._query('SELECT 1 FROM subscribers WHERE chat_id = ?', (chat_id,)))
+
+    def add_subscriber(self, chat_id):
+        """Subscribe a chat, returning False if it already was"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO subscribers (chat_id, subscribed_at) VALUES (?, ?)',
+                (chat_id, time.time())
+            )
+            return cursor.rowcount > 0
+
+    def remove_subscriber(self, chat_id):
+        """Unsubscribe a chat, returning False if it wasn't subscribed"""
+        with self.transaction() as conn:
+            cursor = conn.execute('DELETE FROM subscribers WHERE chat_id = ?', (chat_id,))
+            return cursor.rowcount > 0
+
+    # Followed playlists
+
+    def get_followed_playlists(self):
+        """List every (chat_id, playlist_id) follow in the order they were added"""
+        return self._query('SELECT chat_id, playlist_id FROM chat_playlists ORDER BY followed_at, playlist_id')
+
+    def get_chat_playlists(self, chat_id):
+        """List the playlists a chat follows in the order it added them"""
+        return [row[0] for row in self._query(
+            'SELECT playlist_id FROM chat_playlists WHERE chat_id = ? ORDER BY followed_at, playlist_id', (chat_id,)
+        )]
+
+    def follow_playlist(self, chat_id, playlist_id):
+        """Add a playlist to the ones a chat follows, returning False if it already did"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO chat_playlists (chat_id, playlist_id, followed_at) VALUES (?, ?, ?)',
+                (chat_id, playlist_id, time.time())
+            )
+            return cursor.rowcount > 0
+
+    def unfollow_playlist(self, chat_id, playlist_id):
+        """Stop a chat following a playlist, returning False if it didn't"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                'DELETE FROM chat_playlists WHERE chat_id = ? AND playlist_id = ?', (chat_id, playlist_id)
+            )
+            return cursor.rowcount > 0
+
+    def get_playlist_chats(self, playlist_id):
+        """List the chats that follow a given playlist"""
+        return [row[0] for row in self._query('SELECT chat_id FROM chat_playlists WHERE playlist_id = ?', (playlist_id,))]
+
+    # Snapshots
+
+    def load_snapshot(self, playlist_id):
+        """Load the saved tracks of a playlist in playlist order
+
+        The snapshot is the compacted base plus any change events logged since.
+        """
+        reader = self._reader()
+        # One read transaction, so the base and its events come from the same commit
+        reader.execute('BEGIN')
+        try:
+            rows = reader.execute(
+                'SELECT video_id, title, artists, thumbnail FROM snapshot_tracks WHERE playlist_id = ? ORDER BY position',
+                (playlist_id,)
+            ).fetchall()
+            events = self._pending_events(reader, playlist_id)
+        finally:
+            reader.execute('COMMIT')
+        return apply_events([_row_to_track(row) for row in rows], events)
+
+    def has_snapshot(self, playlist_id):
+        """Check whether a playlist has a saved snapshot"""
+        return bool(self._query('SELECT 1 FROM snapshots WHERE playlist_id = ?', (playlist_id,)))
+
+    def get_snapshot_size(self, playlist_id):
+        """Number of tracks in the saved snapshot, or None without one"""
+        rows = self._query('SELECT track_count FROM snapshots WHERE playlist_id = ?', (playlist_id,))
+        return rows[0][0] if rows else None
+
+    def get_snapshot_fingerprint(self, playlist_id):
+        """Fingerprint of the saved snapshot, or None"""
+        rows = self._query('SELECT fingerprint FROM snapshots WHERE playlist_id = ?', (playlist_id,))
+        return rows[0][0] if rows else None
+
+    def set_snapshot_fingerprint(self, playlist_id, fingerprint, base_fingerprint=None):
+        """Record the fingerprint of a snapshot that is otherwise up to date
+
+        Left alone if the snapshot's fingerprint is no longer base_fingerprint.
+        """
+        with self.transaction() as conn:
+            conn.execute(
+                'UPDATE snapshots SET fingerprint = ? WHERE playlist_id = ? AND fingerprint IS ?',
+                (fingerprint, playlist_id, base_fingerprint)
+            )
+
+    def save_snapshot(self, playlist_id, tracks):
+        """Replace the saved tracks of a playlist with a new base"""
+        with self.transaction() as conn:
+            self._write_snapshot(conn, playlist_id, tracks)
+
+    def _write_snapshot(self, conn, playlist_id, tracks):
+        conn.execute('DELETE FROM snapshot_tracks WHERE playlist_id = ?', (playlist_id,))
+        conn.executemany(
+            'INSERT INTO snapshot_tracks (playlist_id, position, video_id, title, artists, thumbnail) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ((playlist_id, position, *track) for position, track in enumerate(tracks))
+        )
+        # Events logged so far are already part of the new base
+        last_event_id = conn.execute(
+            'SELECT COALESCE(MAX(id), 0) FROM snapshot_events WHERE playlist_id = ?', (playlist_id,)
+        ).fetchone()[0]
+        conn.execute(
+            'INSERT INTO snapshots (playlist_id, track_count, updated_at, base_event_id, pending_events, fingerprint) '
+            'VALUES (?, ?, ?, ?, 0, ?) '
+            'ON CONFLICT (playlist_id) DO UPDATE SET track_count = excluded.track_count, '
+            'updated_at = excluded.updated_at, base_event_id = excluded.base_event_id, pending_events = 0, '
+            'fingerprint = excluded.fingerprint',
+            (playlist_id, len(tracks), time.time(), last_event_id, playlist_fingerprint(tracks))
+        )
+
+    def record_changes(self, playlist_id, events, fingerprint=None, notifications=(), base_fingerprint=None):
+        """Append (action, position, track) change events to a playlist's snapshot
+
+        Costs one row per change instead of a rewrite of the whole playlist.
+        The log is folded into the base once SNAPSHOT_COMPACT_EVENTS pile up.
+        fingerprint is that of the playlist after the changes. notifications
+        are (chat_id, video_id, action, payload) rows queued in the outbox in
+        the same transaction, so a crash can't save the changes but lose them.
+
+        With base_fingerprint, the events are only recorded if the saved
+        snapshot is still the one they were diffed against. Returns False
+        if another process saved a different state first.
+        """
+        events = list(events)
+        if not events:
+            return True
+        now = time.time()
+        with self.transaction() as conn:
+            if base_fingerprint is not None:
+                row = conn.execute('SELECT fingerprint FROM snapshots WHERE playlist_id = ?', (playlist_id,)).fetchone()
+                # Snapshots saved before fingerprints existed can't be checked
+                if row is None or row[0] not in (None, base_fingerprint):
+                    return False
+            self._enqueue(conn, playlist_id, notifications, now)
+            conn.executemany(
+                'INSERT INTO snapshot_events (playlist_id, recorded_at, action, position, video_id, title, artists, thumbnail) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((playlist_id, now, action, position, *track) for action, position, track in events)
+            )
+            delta = sum(1 if action == 'added' else -1 if action == 'removed' else 0 for action, _, _ in events)
+            conn.execute(
+                'UPDATE snapshots SET track_count = track_count + ?, pending_events = pending_events + ?, updated_at = ?, '
+                'fingerprint = ? WHERE playlist_id = ?',
+                (delta, len(events), now, fingerprint, playlist_id)
+            )
+            pending = conn.execute(
+                'SELECT pending_events FROM snapshots WHERE playlist_id = ?', (playlist_id,)
+            ).fetchone()
+            if pending and pending[0] >= SNAPSHOT_COMPACT_EVENTS:
+                self._compact(conn, playlist_id)
+        return True
+
+    def compact_snapshot(self, playlist_id):
+        """Fold the pending change log of a playlist into its base"""
+        with self.transaction() as conn:
+            self._compact(conn, playlist_id)
+
+    def _compact(self, conn, playlist_id):
+        rows = conn.execute(
+            'SELECT video_id, title, artists, thumbnail FROM snapshot_tracks WHERE playlist_id = ? ORDER BY position',
+            (playlist_id,)
+        ).fetchall()
+        tracks = apply_events([_row_to_track(row) for row in rows], self._pending_events(conn, playlist_id))
+        self._write_snapshot(conn, playlist_id, tracks)
+        conn.execute(
+            'DELETE FROM snapshot_events WHERE playlist_id = ? AND recorded_at < ?',
+            (playlist_id, time.time() - SNAPSHOT_HISTORY_DAYS * 86400)
+        )
+
+    def _pending_events(self, conn, playlist_id):
+        rows = conn.execute(
+            'SELECT e.action, e.position, e.video_id, e.title, e.artists, e.thumbnail '
+            'FROM snapshot_events e JOIN snapshots s ON s.playlist_id = e.playlist_id '
+            'WHERE e.playlist_id = ? AND e.id > s.base_event_id ORDER BY e.id',
+            (playlist_id,)
+        ).fetchall()
+        return [(action, position, _row_to_track(row)) for action, position, *row in rows]
+
+    def get_change_history(self, playlist_id, limit=20):
+        """Most recent change events of a playlist, newest first
+
+        A reorder shows up once, as its 'move_in' event.
+        """
+        rows = self._query(
+            'SELECT recorded_at, action, video_id, title, artists, thumbnail FROM snapshot_events '
+            "WHERE playlist_id = ? AND action != 'move_out' ORDER BY id DESC LIMIT ?",
+            (playlist_id, limit)
+        )
+        return [
+            dict(_row_to_track(row).to_dict(), action=action, recorded_at=recorded_at)
+            for recorded_at, action, *row in rows
+        ]
+
+    def delete_snapshot(self, playlist_id):
+        """Forget the saved tracks of a playlist, returning False if there were none"""
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM snapshot_tracks WHERE playlist_id = ?', (playlist_id,))
+            cursor = conn.execute('DELETE FROM snapshots WHERE playlist_id = ?', (playlist_id,))
+            return cursor.rowcount > 0
+
+    # Notification outbox
+
+    def _enqueue(self, conn, playlist_id, notifications, now):
+        conn.executemany(
+            'INSERT OR IGNORE INTO outbox (chat_id, playlist_id, video_id, action, payload, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                (chat_id, playlist_id, video_id, action, json.dumps(payload, ensure_ascii=False), now)
+                for chat_id, video_id, action, payload in notifications
+            )
+        )
+
+    def enqueue_notifications(self, playlist_id, notifications):
+        """Queue (chat_id, video_id, action, payload) notifications for delivery"""
+        with self.transaction() as conn:
+            self._enqueue(conn, playlist_id, notifications, time.time())
+
+    def get_pending_items(self, limit=1000):
+        """Oldest distinct undelivered (playlist_id, video_id, action, payload) items, whichever chats they are for"""
+        rows = self._query(
+            'SELECT playlist_id, video_id, action, payload, MIN(id) AS first_id FROM outbox '
+            'GROUP BY playlist_id, video_id, action ORDER BY first_id LIMIT ?', (limit,)
+        )
+        return [(playlist_id, video_id, action, json.loads(payload))
+                for playlist_id, video_id, action, payload, _ in rows]
+
+    def get_item_chats(self, playlist_id, video_id, action):
+        """Chats an item is still queued for"""
+        return [row[0] for row in self._query(
+            'SELECT chat_id FROM outbox WHERE playlist_id = ? AND video_id = ? AND action = ?',
+            (playlist_id, video_id, action)
+        )]
+
+    def ack_notifications(self, chat_id, keys):
+        """Remove delivered notifications, given as (playlist_id, video_id, action) keys of one chat"""
+        with self.transaction() as conn:
+            conn.executemany(
+                'DELETE FROM outbox WHERE playlist_id = ? AND video_id = ? AND action = ? AND chat_id = ?',
+                ((playlist_id, video_id, action, chat_id) for playlist_id, video_id, action in keys)
+            )
+
+    def fail_notifications(self, chat_id, keys, max_attempts):
+        """Count a failed delivery attempt, dropping notifications that used up max_attempts"""
+        with self.transaction() as conn:
+            conn.executemany(
+                'UPDATE outbox SET attempts = attempts + 1 '
+                'WHERE playlist_id = ? AND video_id = ? AND action = ? AND chat_id = ?',
+                ((playlist_id, video_id, action, chat_id) for playlist_id, video_id, action in keys)
+            )
+            cursor = conn.execute('DELETE FROM outbox WHERE attempts >= ?', (max_attempts,))
+            return cursor.rowcount
+
+    def clear_notifications(self, chat_id, playlist_id=None):
+        """Drop everything queued for a chat, or only what is queued about one playlist"""
+        with self.transaction() as conn:
+            if playlist_id is None:
+                conn.execute('DELETE FROM outbox WHERE chat_id = ?', (chat_id,))
+            else:
+                conn.execute('DELETE FROM outbox WHERE chat_id = ? AND playlist_id = ?', (chat_id, playlist_id))
+
+    def outbox_depth(self):
+        """Number of notifications waiting to be delivered"""
+        return self._query('SELECT COUNT(*) FROM outbox')[0][0]
+
+    # Telegram file IDs
+
+    def get_thumbnail_file_id(self, url):
+        """Telegram file_id of a thumbnail that was uploaded before, or None"""
+        rows = self._query('SELECT file_id FROM thumbnail_file_ids WHERE url = ?', (url,))
+        return rows[0][0] if rows else None
+
+    def set_thumbnail_file_id(self, url, file_id):
+        """Remember the Telegram file_id an uploaded thumbnail got"""
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO thumbnail_file_ids (url, file_id, created_at) VALUES (?, ?, ?)',
+                (url, file_id, time.time())
+            )
+
+    def delete_thumbnail_file_id(self, url):
+        """Forget a file_id Telegram no longer accepts"""
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM thumbnail_file_ids WHERE url = ?', (url,))
+
+    # Leases
+
+    def acquire_lease(self, name, owner, ttl):
+        """Take or renew the lease called name for ttl seconds; False if another owner holds it
+
+        Leases are shared by every process using the database, so at most one
+        of them at a time does the work a lease stands for.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                'INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+                'WHERE leases.owner = excluded.owner OR leases.expires_at < ?',
+                (name, owner, now + ttl, now)
+            )
+            return conn.execute('SELECT owner FROM leases WHERE name = ?', (name,)).fetchone()[0] == owner
+
+    def release_lease(self, name, owner):
+        """Give up a lease so another process can take it right away"""
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+    # JSON migration
+
+    def migrate_json_state(self, default_playlist_id, directory='.'):
+        """Import the old JSON state files once, then move them out of the way
+
+        Handles subscribers.json, user_playlists.json, playlist_state.json (the
+        default playlist) and playlist_state_<id>.json, where <id> is either a
+        playlist ID or, in older versions, a chat ID.
+        """
+        if self._query("SELECT 1 FROM meta WHERE key = 'json_migrated'"):
+            return False
+
+        def read_json(name):
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        names = sorted(os.listdir(directory))
+        migrated = []
+        with self.transaction() as conn:
+            now = time.time()
+            if 'subscribers.json' in names:
+                for order, chat_id in enumerate(read_json('subscribers.json')):
+                    conn.execute(
+                        'INSERT OR IGNORE INTO subscribers (chat_id, subscribed_at) VALUES (?, ?)',
+                        (int(chat_id), now + order * 1e-6)
+                    )
+                migrated.append('subscribers.json')
+
+            user_playlists = {}
+            if 'user_playlists.json' in names:
+                user_playlists = {int(chat_id): pid for chat_id, pid in read_json('user_playlists.json').items()}
+                conn.executemany(
+                    'INSERT OR IGNORE INTO chat_playlists (chat_id, playlist_id, followed_at) VALUES (?, ?, ?)',
+                    ((chat_id, pid, now) for chat_id, pid in user_playlists.items())
+                )
+                migrated.append('user_playlists.json')
+
+            snapshots = {}
+            if 'playlist_state.json' in names and default_playlist_id:
+                snapshots[default_playlist_id] = read_json('playlist_state.json')
+                migrated.append('playlist_state.json')
+
+            legacy_user_states = {}
+            for name in names:
+                if not (name.startswith('playlist_state_') and name.endswith('.json')):
+                    continue
+                key = name[len('playlist_state_'):-len('.json')]
+                if key.lstrip('-').isdigit():
+                    legacy_user_states[int(key)] = read_json(name)
+                else:
+                    snapshots[key] = read_json(name)
+                migrated.append(name)
+
+            # Old per-chat states only seed playlists with no shared state yet
+            for chat_id, tracks in legacy_user_states.items():
+                playlist_id = user_playlists.get(chat_id, default_playlist_id)
+                if playlist_id and tracks:
+                    snapshots.setdefault(playlist_id, tracks)
+
+            for playlist_id, tracks in snapshots.items():
+                self._write_snapshot(conn, playlist_id, [Track.from_dict(track) for track in tracks if track])
+
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (str(now),))
+
+        if migrated:
+            backup_dir = os.path.join(directory, JSON_BACKUP_DIR)
+            os.makedirs(backup_dir, exist_ok=True)
+            for name in migrated:
+                shutil.move(os.path.join(directory, name), os.path.join(backup_dir, name))
+            log.info(f"📦 Migrated {len(migrated)} JSON state files into {self.path} (originals in {backup_dir}/)")
+        return True
+
+
+def _row_to_track(row):
+    return Track(*row)
+
+
+state_store = StateStore()
@@ -0,0 +1,203 @@
+import os
+import io
+import sys
+import json
+import time
+import pstats
+import signal
+import logging
+import cProfile
+import itertools
+import contextvars
+from contextlib import contextmanager
+
+# Creating this file (or sending SIGUSR1) profiles the next poll cycle
+PROFILE_TRIGGER_FILE = os.getenv('PROFILE_TRIGGER_FILE', 'profile_next_cycle')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+log = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_ids = itertools.count(1)
+
+
+class Span:
+    """A timed unit of work; spans opened inside it (and in tasks it starts) are its children"""
+    __slots__ = ('name', 'span_id', 'trace_id', 'parent_id', 'fields', 'started')
+
+    def __init__(self, name, parent, fields):
+        self.name = name
+        self.span_id = f'{next(_ids):x}'
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.parent_id = parent.span_id if parent else None
+        self.fields = fields
+        self.started = time.perf_counter()
+
+    def set(self, **fields):
+        """Attach result fields, logged when the span ends"""
+        self.fields.update(fields)
+
+    @property
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+@contextmanager
+def span(name, level=logging.DEBUG, **fields):
+    """Time a block as a span and log it, with its fields, when it ends
+
+    Works in sync and async code: the current span lives in a context
+    variable, which asyncio copies into every task a span starts.
+    """
+    current = Span(name, _current_span.get(), fields)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=f'{type(e).__name__}: {e}')
+        level = max(level, logging.WARNING)
+        raise
+    finally:
+        _current_span.reset(token)
+        if log.isEnabledFor(level):
+            fields = dict(current.fields, duration_ms=round(current.elapsed_ms, 1))
+            log.log(level, '%s finished', name, extra={'fields': fields, 'span': current})
+
+
+def current_trace_id():
+    """Trace ID of the span the caller runs in, or None outside any span"""
+    current = _current_span.get()
+    return current.trace_id if current else None
+
+
+class SpanFilter(logging.Filter):
+    """Stamp every record with the span it was logged in"""
+
+    def filter(self, record):
+        current = getattr(record, 'span', None) or _current_span.get()
+        record.trace_id = current.trace_id if current else '-'
+        record.span_id = current.span_id if current else '-'
+        record.span_name = current.name if current else '-'
+        if not hasattr(record, 'fields'):
+            record.fields = {}
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """time level logger [trace/span] message key=value ..."""
+
+    def format(self, record):
+        line = (f"{self.formatTime(record)} {record.levelname:<7} {record.name} "
+                f"[{record.trace_id}/{record.span_id}] {record.getMessage()}")
+        if record.fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in record.fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, for log pipelines"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'trace': record.trace_id,
+            'span': record.span_id,
+            'span_name': record.span_name,
+        }
+        entry.update(record.fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=None, fmt=None):
+    """Send all logging to stdout in the configured format; safe to call more than once
+
+    level defaults to LOG_LEVEL (INFO) and fmt to LOG_FORMAT: 'text' for
+    humans, 'json' for one JSON object per line.
+    """
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    fmt = (fmt or os.getenv('LOG_FORMAT', 'text')).lower()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if getattr(handler, '_tracing', False):
+            root.removeHandler(handler)
+    handler = logging.StreamHandler(sys.stdout)
+    handler._tracing = True
+    handler.addFilter(SpanFilter())
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(level)
+    # Library chatter only when debugging
+    for name in ('httpx', 'httpcore', 'telegram', 'apscheduler', 'werkzeug', 'urllib3'):
+        logging.getLogger(name).setLevel(max(root.level, logging.WARNING))
+
+
+class CycleProfiler:
+    """Run cProfile over one poll cycle when asked to
+
+    Touch trigger_file or send SIGUSR1 and the next cycle is profiled. The
+    stats are written to output_dir for snakeviz/pstats and the top entries
+    are logged. Only the event loop thread is profiled, so time spent in
+    fetch worker threads shows up as waiting.
+    """
+
+    def __init__(self, trigger_file=PROFILE_TRIGGER_FILE, output_dir=PROFILE_DIR, top=25):
+        self.trigger_file = trigger_file
+        self.output_dir = output_dir
+        self.top = top
+        self._requested = False
+
+    def request(self, *args):
+        """Profile the next cycle (usable as a signal handler)"""
+        self._requested = True
+
+    def install_signal_handler(self):
+        """Profile the next cycle on SIGUSR1, where the platform has it"""
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.request)
+
+    def _take_request(self):
+        requested, self._requested = self._requested, False
+        if self.trigger_file and os.path.exists(self.trigger_file):
+            try:
+                os.remove(self.trigger_file)
+            except OSError:
+                pass
+            requested = True
+        return requested
+
+    @contextmanager
+    def maybe_profile(self, label='cycle'):
+        """Profile the block if a profile was requested, otherwise just run it"""
+        if not self._take_request():
+            yield None
+            return
+        profiler = cProfile.Profile()
+        log.info('🔬 Profiling this %s', label)
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            self._report(profiler, label)
+
+    def _report(self, profiler, label):
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+            profiler.dump_stats(path)
+        except OSError as e:
+            log.warning('Could not save profile: %s', e)
+            path = None
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(self.top)
+        log.info('🔬 Profile of this %s (saved to %s):\n%s', label, path, report.getvalue())
+
+
+cycle_profiler = CycleProfiler()
@@ -0,0 +1,100 @@
+import os
+import hmac
+import hashlib
+import logging
+from telegram import Update
+from metrics import metrics, health_report
+
+log = logging.getLogger(__name__)
+
+# Public HTTPS base URL of the bot; setting it switches from polling to webhook mode
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Telegram sends this back in a header so forged updates can be rejected
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+PORT = int(os.getenv('PORT', 8080))
+
+webhook_updates = metrics.counter('webhook_updates_total', 'Updates received on the webhook by outcome', ('outcome',))
+
+
+def webhook_secret(token):
+    """WEBHOOK_SECRET, or a value derived from the bot token that survives restarts"""
+    return WEBHOOK_SECRET or hashlib.sha256(f'webhook:{token}'.encode()).hexdigest()
+
+
+def build_app(application, secret, path=WEBHOOK_PATH):
+    """Starlette app serving Telegram updates, /health and /metrics from the bot's event loop"""
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, PlainTextResponse, Response
+    from starlette.routing import Route
+
+    async def telegram_update(request):
+        if not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret):
+            webhook_updates.inc(outcome='forbidden')
+            return Response(status_code=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except ValueError:
+            webhook_updates.inc(outcome='invalid')
+            return Response(status_code=400)
+        webhook_updates.inc(outcome='accepted')
+        # Answer right away; the application processes the queue on its own
+        await application.update_queue.put(update)
+        return Response()
+
+    async def home(request):
+        return PlainTextResponse("🎵 YouTube Music Playlist Monitor Bot is alive!")
+
+    async def health(request):
+        body, status = health_report()
+        return JSONResponse(body, status_code=status)
+
+    async def prometheus_metrics(request):
+        return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+    return Starlette(routes=[
+        Route(path, telegram_update, methods=['POST']),
+        Route('/', home),
+        Route('/health', health),
+        Route('/metrics', prometheus_metrics),
+    ])
+
+
+async def run_webhook(application, allowed_updates, url=WEBHOOK_URL, path=WEBHOOK_PATH, port=PORT):
+    """Run the bot on one uvicorn server until it is stopped with SIGINT or SIGTERM
+
+    Replaces run_polling() plus the Flask keep-alive thread: updates are
+    pushed by Telegram to url + path, and /health and /metrics are served by
+    the same server. The application lifecycle, including post_init and
+    post_shutdown, matches run_polling().
+    """
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise RuntimeError("Webhook mode needs starlette and uvicorn: pip install starlette uvicorn") from e
+
+    secret = webhook_secret(application.bot.token)
+    server = uvicorn.Server(uvicorn.Config(
+        build_app(application, secret, path), host='0.0.0.0', port=port,
+        log_level='warning', access_log=False, lifespan='off'
+    ))
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.bot.set_webhook(
+            url=url.rstrip('/') + path, allowed_updates=allowed_updates, secret_token=secret
+        )
+        await application.start()
+        log.info(f"🪝 Webhook mode: receiving updates on {url.rstrip('/')}{path}, serving on port {port}")
+        try:
+            await server.serve()
+        finally:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)